@@ -1,6 +1,19 @@
 import os
 import random
 import math
+import heapq
+import json
+import time
+import queue
+import threading
+import functools
+import struct
+import multiprocessing
+from multiprocessing import shared_memory
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import numpy as np
 import pygame
 from os import listdir
 from os.path import isfile, join, abspath, dirname
@@ -11,10 +24,129 @@ pygame.display.set_caption("Platformer")
 WIDTH, HEIGHT = 1000, 800
 FPS = 60
 PLAYER_VEL = 5
-window = pygame.display.set_mode((WIDTH, HEIGHT))
+LANDING_DUST_SPEED = 4  # minimum fall speed that kicks up dust
+BACKGROUND_FILL = (179, 194, 209)  # average colour of Blue.png, used when tiles are switched off
 
 # Get the absolute path of the directory where this script is located
 BASE_DIR = dirname(abspath(__file__))
+SAVE_PATH = join(BASE_DIR, "quicksave.mmsave")
+
+# -------------------- Display --------------------
+class Display:
+    """
+    Internal render target presented to the window.
+
+    The game always draws into `surface` at the logical WIDTH x HEIGHT,
+    where the scale2x'd art is pixel-exact, and present() puts it on
+    screen. Windows larger than that (scale > 1 or fullscreen) use SCALED
+    mode, where SDL stretches the surface on the GPU, so they cost the same
+    as a small one. Only when no renderer is available is the surface
+    scaled by an integer factor in software, which gets slower as the
+    window grows. At scale 1 it is drawn straight to the window.
+    """
+    def __init__(self, scale=1, scaled=False, vsync=False, fullscreen=False):
+        """
+        Open the game window.
+
+        Args:
+            scale (int): Integer window scale relative to WIDTH x HEIGHT.
+            scaled (bool): Use pygame.SCALED even at scale 1 windowed.
+            vsync (bool): Wait for vertical blank when presenting; implies scaled.
+            fullscreen (bool): Open a fullscreen window.
+        """
+        self.surface = None
+        self.open(scale, scaled, vsync, fullscreen)
+
+    def open(self, scale=1, scaled=False, vsync=False, fullscreen=False):
+        """
+        (Re)open the window with new display settings.
+
+        SCALED is used whenever the window is larger than the logical size.
+        It needs a hardware renderer; if one cannot be created the window
+        falls back to software scaling.
+
+        Args:
+            scale (int): Integer window scale relative to WIDTH x HEIGHT.
+            scaled (bool): Use pygame.SCALED even at scale 1 windowed.
+            vsync (bool): Wait for vertical blank when presenting; implies scaled.
+            fullscreen (bool): Open a fullscreen window.
+
+        Raises:
+            ValueError: If scale is not a positive integer.
+        """
+        if not isinstance(scale, int) or scale < 1:
+            raise ValueError(f"Display scale must be a positive integer, got {scale!r}")
+        flags = pygame.FULLSCREEN if fullscreen else 0
+        scaled = scaled or vsync or scale > 1 or fullscreen
+        window = None
+        if scaled:
+            try:
+                window = pygame.display.set_mode((WIDTH, HEIGHT), flags | pygame.SCALED,
+                                                 vsync=int(vsync))
+            except pygame.error:
+                scaled = False  # no renderer (e.g. dummy driver)
+            else:
+                self._resize_scaled_window(scale, fullscreen)
+        if window is None:
+            window = pygame.display.set_mode((WIDTH * scale, HEIGHT * scale), flags)
+
+        self.window = window
+        self.scale = scale
+        self.scaled = scaled
+        self.vsync = vsync
+        self.fullscreen = fullscreen
+        if scaled or scale == 1:
+            self.surface = window
+        elif self.surface is None or self.surface is window:
+            self.surface = pygame.Surface((WIDTH, HEIGHT)).convert()
+
+    @staticmethod
+    def _resize_scaled_window(scale, fullscreen):
+        # SDL picks the largest scale that fits the desktop; honour the
+        # requested one instead when windowed.
+        if fullscreen:
+            return
+        try:
+            from pygame._sdl2.video import Window
+            Window.from_display_module().size = (WIDTH * scale, HEIGHT * scale)
+        except (ImportError, pygame.error):
+            pass
+
+    def toggle_fullscreen(self):
+        """
+        Switch between windowed and fullscreen, keeping the other settings.
+        """
+        self.open(self.scale, self.scaled, self.vsync, not self.fullscreen)
+
+    def present(self, rects=None):
+        """
+        Show the contents of the render surface in the window.
+
+        Args:
+            rects (list, optional): Changed areas of the render surface; only
+                these are scaled and updated. Defaults to the whole surface.
+        """
+        if self.surface is not self.window:
+            if rects is None:
+                pygame.transform.scale(self.surface, self.window.get_size(), self.window)
+            else:
+                scale = self.scale
+                targets = []
+                for rect in rects:
+                    target = pygame.Rect(rect.x * scale, rect.y * scale,
+                                         rect.w * scale, rect.h * scale)
+                    pygame.transform.scale(self.surface.subsurface(rect), target.size,
+                                           self.window.subsurface(target))
+                    targets.append(target)
+                rects = targets
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+
+
+display = Display()
+window = display.surface
 
 def flip(sprites):
     """
@@ -86,8 +218,175 @@ def get_block(size):
     surface.blit(image, (0, 0), rect)
     return pygame.transform.scale2x(surface)
 
+_BLOCK_SURFACES = {}
+
+def get_block_cached(size):
+    """
+    Return the terrain block sprite for a size, loading it only once.
+
+    Args:
+        size (int): Size of the block (one side length).
+
+    Returns:
+        pygame.Surface: Shared scaled block surface. Callers must not draw on it.
+    """
+    surface = _BLOCK_SURFACES.get(size)
+    if surface is None:
+        surface = _BLOCK_SURFACES[size] = get_block(size)
+    return surface
+
+_SPRITE_SHEETS = {}
+
+def load_sprite_sheets_cached(dir1, dir2, width, height):
+    """
+    Return sprite sheets for a trap or effect, loading them only once.
+
+    Args:
+        dir1 (str): Asset subfolder (e.g. "Traps").
+        dir2 (str): Subfolder of dir1 (e.g. "Fire").
+        width (int): Width of a single frame.
+        height (int): Height of a single frame.
+
+    Returns:
+        dict: Shared frame lists from load_sprite_sheets(). Callers must not draw on them.
+    """
+    key = (dir1, dir2, width, height)
+    sprites = _SPRITE_SHEETS.get(key)
+    if sprites is None:
+        sprites = _SPRITE_SHEETS[key] = load_sprite_sheets(dir1, dir2, width, height)
+    return sprites
+
+_MANGO_IMAGES = {}
+
+def get_mango_image(width, height):
+    """
+    Return the mango sprite scaled to a size, loading it only once.
+
+    Args:
+        width (int): Mango width.
+        height (int): Mango height.
+
+    Returns:
+        pygame.Surface: Shared scaled mango surface.
+
+    Raises:
+        FileNotFoundError: If the mango image is missing.
+    """
+    image = _MANGO_IMAGES.get((width, height))
+    if image is None:
+        path = join(BASE_DIR, "assets", "Items", "Fruits", "mango.png")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Cannot find mango: {path}")
+        image = pygame.image.load(path).convert_alpha()
+        image = _MANGO_IMAGES[(width, height)] = pygame.transform.scale(image, (width, height))
+    return image
+
+# -------------------- Animation --------------------
+class AnimationClock:
+    """
+    Global animation tick shared by every animated entity.
+
+    Entities only remember the tick their current animation started on, so
+    advancing every animation in the game is a single increment here.
+    """
+    def __init__(self):
+        """
+        Start the clock at tick 0.
+        """
+        self.tick = 0
+
+    def advance(self, ticks=1):
+        """
+        Move the clock forward.
+
+        Args:
+            ticks (int): Number of ticks to advance.
+        """
+        self.tick += ticks
+
+ANIMATION_CLOCK = AnimationClock()
+
+
+class AnimationTable:
+    """
+    Sprite sheets compiled into per-tick frame and mask tables.
+
+    Row `state * len(directions) + direction` holds one surface and one
+    mask for every tick of that animation's loop, so picking the current
+    frame is `images[row][ticks % periods[row]]`. Use get_animation_table()
+    so entities sharing a sprite dict also share its table.
+    """
+    def __init__(self, sprites, states, directions=("",), delay=3):
+        """
+        Compile a sprite dict.
+
+        Args:
+            sprites (dict): Frame lists keyed "<state>_<direction>", or "<state>"
+                when directions is ("",).
+            states (tuple): State names; a state's position is its enum value.
+            directions (tuple): Direction names; position is the direction value.
+            delay (int): Ticks each frame is shown for.
+        """
+        self.sprites = sprites
+        self.states = states
+        self.directions = directions
+        self.delay = delay
+        self.images = []
+        self.masks = []
+        self.periods = []
+        masks = {}
+        for state in states:
+            for direction in directions:
+                frames = sprites[f"{state}_{direction}" if direction else state]
+                for frame in frames:
+                    if id(frame) not in masks:
+                        masks[id(frame)] = pygame.mask.from_surface(frame)
+                self.images.append(tuple(frame for frame in frames for _ in range(delay)))
+                self.masks.append(tuple(masks[id(frame)] for frame in frames
+                                        for _ in range(delay)))
+                self.periods.append(len(frames) * delay)
+
+_ANIMATION_TABLES = {}
+
+def get_animation_table(sprites, states, directions=("",), delay=3):
+    """
+    Return the compiled AnimationTable for a sprite dict, compiling it only once.
+
+    Args:
+        sprites (dict): Sprite dict, e.g. from load_sprite_sheets().
+        states (tuple): State names.
+        directions (tuple): Direction names.
+        delay (int): Ticks each frame is shown for.
+
+    Returns:
+        AnimationTable: Shared table.
+    """
+    key = (id(sprites), states, directions, delay)
+    table = _ANIMATION_TABLES.get(key)
+    if table is None or table.sprites is not sprites:
+        table = _ANIMATION_TABLES[key] = AnimationTable(sprites, states, directions, delay)
+    return table
+
+
+class Animated:
+    """
+    Mixin for entities whose animation phase is read off ANIMATION_CLOCK.
+
+    animation_count is the number of ticks since the current animation
+    started; setting it moves the start tick instead of storing a counter.
+    """
+    animation_start = 0
+
+    @property
+    def animation_count(self):
+        return ANIMATION_CLOCK.tick - self.animation_start
+
+    @animation_count.setter
+    def animation_count(self, value):
+        self.animation_start = ANIMATION_CLOCK.tick - value
+
 # -------------------- Player Class --------------------
-class Player(pygame.sprite.Sprite):
+class Player(Animated, pygame.sprite.Sprite):
     """
     Represents the player character.
 
@@ -98,6 +397,9 @@ class Player(pygame.sprite.Sprite):
     GRAVITY = 1
     SPRITES = load_sprite_sheets("MainCharacters", "MaskDude", 32, 32, True)
     ANIMATION_DELAY = 3
+    STATES = ("idle", "run", "jump", "double_jump", "fall", "hit")
+    IDLE, RUN, JUMP, DOUBLE_JUMP, FALL, HIT = range(len(STATES))
+    DIRECTIONS = ("left", "right")
 
     def __init__(self, x, y, width, height):
         """
@@ -115,6 +417,8 @@ class Player(pygame.sprite.Sprite):
         self.y_vel = 0
         self.mask = None
         self.direction = "left"
+        self.animations = get_animation_table(self.SPRITES, self.STATES, self.DIRECTIONS,
+                                              self.ANIMATION_DELAY)
         self.animation_count = 0
         self.fall_count = 0
         self.jump_count = 0
@@ -211,33 +515,33 @@ class Player(pygame.sprite.Sprite):
         """
         Update the player's sprite based on velocity and state.
         """
-        sprite_sheet = "idle"
+        state = self.IDLE
         if self.hit:
-            sprite_sheet = "hit"
+            state = self.HIT
         elif self.y_vel < 0:
             if self.jump_count == 1:
-                sprite_sheet = "jump"
+                state = self.JUMP
             elif self.jump_count == 2:
-                sprite_sheet = "double_jump"
+                state = self.DOUBLE_JUMP
         elif self.y_vel > self.GRAVITY * 2:
-            sprite_sheet = "fall"
+            state = self.FALL
         elif self.x_vel != 0:
-            sprite_sheet = "run"
+            state = self.RUN
 
-        sprite_sheet_name = sprite_sheet + "_" + self.direction
-        sprites = self.SPRITES[sprite_sheet_name]
-        sprite_index = (self.animation_count // self.ANIMATION_DELAY) % len(sprites)
-        self.sprite = sprites[sprite_index]
-        self.animation_count += 1
-        self.update()
+        table = self.animations
+        row = state * len(self.DIRECTIONS) + self.DIRECTIONS.index(self.direction)
+        tick = (ANIMATION_CLOCK.tick - self.animation_start) % table.periods[row]
+        self.sprite = table.images[row][tick]
+        self.mask = table.masks[row][tick]
+        self.rect = self.sprite.get_rect(topleft=(self.rect.x, self.rect.y))
 
     def update(self):
         """
-        Update the player's rect and mask based on the current sprite frame.
-        """
+        Update the player's rect for the current sprite frame.
 
+        The mask already comes from the animation table (see update_sprite()).
+        """
         self.rect = self.sprite.get_rect(topleft=(self.rect.x, self.rect.y))
-        self.mask = pygame.mask.from_surface(self.sprite)
 
     def draw(self, win, offset_x):
          """
@@ -297,9 +601,10 @@ class Block(Object):
             size (int): Size of the square block.
         """
         super().__init__(x, y, size, size)
-        block = get_block(size)
+        block = get_block_cached(size)
         self.image.blit(block, (0, 0))
         self.mask = pygame.mask.from_surface(self.image)
+        self.terrain = None  # TerrainGrid that indexes and renders this block
 
     def update(self):
         """
@@ -322,9 +627,14 @@ class Block(Object):
     def destroy(self):
         """
         Make the block invisible and remove its collision mask.
+
+        If the block belongs to a TerrainGrid it is also taken out of the
+        grid, which only touches the cells and chunk area under the block.
         """
         self.image.fill((0, 0, 0, 0))
-        self.mask = pygame.mask.from_surface(self.image)
+        self.mask.clear()
+        if self.terrain is not None:
+            self.terrain.remove(self)
 
     def highlight(self, color=(0, 255, 0)):
         """
@@ -334,6 +644,8 @@ class Block(Object):
             color (tuple): RGB color for the outline.
         """
         pygame.draw.rect(self.image, color, self.image.get_rect(), 2)
+        if self.terrain is not None:
+            self.terrain.update(self, self.rect)
 
     def get_position(self):
         """
@@ -346,17 +658,21 @@ class Block(Object):
 
     def resize(self, new_size):
         """
-        Resize the block and reload the block sprite.
+        Resize the block and swap in the block sprite for the new size.
 
         Args:
             new_size (int): New block size.
         """
+        old_rect = self.rect.copy()
         self.rect.width = new_size
         self.rect.height = new_size
-        block = get_block(new_size)
+        self.width = self.height = new_size
+        block = get_block_cached(new_size)
         self.image = pygame.Surface((new_size, new_size), pygame.SRCALPHA)
         self.image.blit(block, (0, 0))
         self.mask = pygame.mask.from_surface(self.image)
+        if self.terrain is not None:
+            self.terrain.update(self, old_rect)
 
     def move(self, x, y):
         """
@@ -366,8 +682,11 @@ class Block(Object):
             x (int): New x position.
             y (int): New y position.
         """
+        old_rect = self.rect.copy()
         self.rect.x = x
         self.rect.y = y
+        if self.terrain is not None:
+            self.terrain.update(self, old_rect)
 
     def is_above(self, player):
         """
@@ -384,11 +703,12 @@ class Block(Object):
                 player.rect.left < self.rect.right)
 
 
-class Fire(Object):
+class Fire(Animated, Object):
     """
     Animated fire trap that can be toggled on/off and damages the player.
     """
     ANIMATION_DELAY = 3
+    STATES = ("off", "on")
     def __init__(self, x, y, width, height):
         """
         Create a fire trap.
@@ -400,9 +720,12 @@ class Fire(Object):
             height (int): Sprite height.
         """
         super().__init__(x, y, width, height, "fire")
-        self.fire = load_sprite_sheets("Traps", "Fire", width, height)
+        self.fire = load_sprite_sheets_cached("Traps", "Fire", width, height)
+        self.animations = get_animation_table(self.fire, self.STATES,
+                                              delay=self.ANIMATION_DELAY)
         self.image = self.fire["off"][0]
-        self.mask = pygame.mask.from_surface(self.image)
+        self.rect = self.image.get_rect(topleft=(x, y))  # frames are drawn at twice the size
+        self.mask = self.animations.masks[0][0]
         self.animation_count = 0
         self.animation_name = "off"
 
@@ -420,16 +743,14 @@ class Fire(Object):
 
     def loop(self):
         """
-        Update fire animation frames each tick.
+        Show the frame for the current ANIMATION_CLOCK tick.
         """
-        sprites = self.fire[self.animation_name]
-        sprite_index = (self.animation_count // self.ANIMATION_DELAY) % len(sprites)
-        self.image = sprites[sprite_index]
-        self.animation_count += 1
+        table = self.animations
+        row = self.animation_name == "on"
+        tick = (ANIMATION_CLOCK.tick - self.animation_start) % table.periods[row]
+        self.image = table.images[row][tick]
+        self.mask = table.masks[row][tick]
         self.rect = self.image.get_rect(topleft=(self.rect.x, self.rect.y))
-        self.mask = pygame.mask.from_surface(self.image)
-        if self.animation_count // self.ANIMATION_DELAY >= len(sprites):
-            self.animation_count = 0
 
     def toggle(self):
         """
@@ -475,9 +796,11 @@ class Fire(Object):
         """
         self.rect.width = width
         self.rect.height = height
-        self.fire = load_sprite_sheets("Traps", "Fire", width, height)
+        self.fire = load_sprite_sheets_cached("Traps", "Fire", width, height)
+        self.animations = get_animation_table(self.fire, self.STATES,
+                                              delay=self.ANIMATION_DELAY)
         self.image = self.fire[self.animation_name][0]
-        self.mask = pygame.mask.from_surface(self.image)
+        self.mask = self.animations.masks[self.animation_name == "on"][0]
 
 # -------------------- Mango Class --------------------
 class Mango(Object):
@@ -495,141 +818,3491 @@ class Mango(Object):
             height (int): Mango height.
         """
         super().__init__(x, y, width, height, "mango")
-        path = join(BASE_DIR, "assets", "Items", "Fruits", "mango.png")
-        if not os.path.exists(path):
-            raise FileNotFoundError(f"Cannot find mango: {path}")
-        self.image = pygame.image.load(path).convert_alpha()
-        self.image = pygame.transform.scale(self.image, (width, height))
+        self.image = get_mango_image(width, height)
         self.mask = pygame.mask.from_surface(self.image)
+        self.collected = False
 
-# -------------------- Background --------------------
-def get_background(name):
+# -------------------- Terrain Grid --------------------
+class TerrainGrid:
     """
-    Load and tile the background image across the window.
-
-    Args:
-        name (str): Background image filename.
+    Spatial index and pre-rendered layer for terrain blocks.
 
-    Returns:
-        tuple: (tiles, image) where tiles is a list of positions to blit,
-               and image is the loaded background surface.
+    Blocks are bucketed into square cells for collision queries and drawn
+    once into chunk surfaces. Destroying, moving or resizing a block only
+    updates the cells it covers and redraws the chunk area under it, so a
+    mutation costs the same no matter how large the level is.
     """
-    path = join(BASE_DIR, "assets", "Background", name)
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"Cannot find background: {path}")
-    image = pygame.image.load(path)
-    _, _, width, height = image.get_rect()
-    tiles = []
+    def __init__(self, cell_size=96, chunk_size=512):
+        """
+        Create an empty terrain grid.
 
-    for i in range(WIDTH // width + 1):
-        for j in range(HEIGHT // height + 1):
-            pos = (i * width, j * height)
-            tiles.append(pos)
+        Args:
+            cell_size (int): Side length of a collision cell.
+            chunk_size (int): Side length of a pre-rendered chunk surface.
+        """
+        self.cell_size = cell_size
+        self.chunk_size = chunk_size
+        self.revision = 0  # bumped whenever the rendered layer changes
+        self.cells = {}
+        self.chunks = {}
+        self.count = 0
+        self.listeners = []  # called with the changed rect, e.g. NavGraph.update
 
-    return tiles, image
+    def __len__(self):
+        return self.count
 
-# -------------------- Game Loop Helpers --------------------
-def draw(window, background, bg_image, player, objects, offset_x):
+    def _keys(self, rect, size):
+        """
+        Yield the (column, row) keys of all grid squares that rect touches.
+
+        Args:
+            rect (pygame.Rect): Area in world coordinates.
+            size (int): Side length of a grid square.
+        """
+        if rect.width <= 0 or rect.height <= 0:
+            return
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                yield cx, cy
+
+    def _insert(self, block):
+        for key in self._keys(block.rect, self.cell_size):
+            self.cells.setdefault(key, []).append(block)
+
+    def _discard(self, block, rect):
+        for key in self._keys(rect, self.cell_size):
+            cell = self.cells.get(key)
+            if cell is None or block not in cell:
+                continue
+            cell.remove(block)
+            if not cell:
+                del self.cells[key]
+
+    def add(self, block):
+        """
+        Index a block and draw it into the terrain layer.
+
+        Args:
+            block (Block): Block to add.
+        """
+        block.terrain = self
+        self._insert(block)
+        self.count += 1
+        self._redraw(block.rect)
+        self._notify(block.rect)
+
+    def remove(self, block):
+        """
+        Remove a block from the index and erase it from the terrain layer.
+
+        Args:
+            block (Block): Block to remove.
+        """
+        self._discard(block, block.rect)
+        block.terrain = None
+        self.count -= 1
+        self._redraw(block.rect)
+        self._notify(block.rect)
+
+    def prune(self, rect):
+        """
+        Free the pre-rendered chunks in an area that no longer hold any blocks.
+
+        Args:
+            rect (pygame.Rect): Area to check, usually a region that was just cleared.
+        """
+        size = self.chunk_size
+        for key in self._keys(rect, size):
+            area = pygame.Rect(key[0] * size, key[1] * size, size, size)
+            if key in self.chunks and not self.query(area):
+                del self.chunks[key]
+
+    def update(self, block, old_rect):
+        """
+        Re-index and redraw a block after its rect or image changed.
+
+        Args:
+            block (Block): Block that changed.
+            old_rect (pygame.Rect): Rect the block covered before the change.
+        """
+        self._discard(block, old_rect)
+        self._insert(block)
+        self._redraw(old_rect)
+        self._redraw(block.rect)
+        self._notify(old_rect.union(block.rect))
+
+    def _notify(self, rect):
+        for listener in self.listeners:
+            listener(rect)
+
+    def query(self, rect):
+        """
+        Get the blocks overlapping an area.
+
+        Args:
+            rect (pygame.Rect): Area in world coordinates.
+
+        Returns:
+            list: Blocks whose rect collides with the area.
+        """
+        found = {}
+        for key in self._keys(rect, self.cell_size):
+            for block in self.cells.get(key, ()):
+                if block.rect.colliderect(rect):
+                    found[block] = None
+        return list(found)
+
+    def _redraw(self, rect):
+        """
+        Repaint the part of the terrain layer covered by rect.
+
+        Args:
+            rect (pygame.Rect): Area in world coordinates.
+        """
+        size = self.chunk_size
+        blocks = self.query(rect)
+        self.revision += 1
+        for key in self._keys(rect, size):
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                if not blocks:
+                    continue
+                chunk = self.chunks[key] = pygame.Surface((size, size), pygame.SRCALPHA)
+            ox, oy = key[0] * size, key[1] * size
+            area = rect.move(-ox, -oy).clip(chunk.get_rect())
+            chunk.fill((0, 0, 0, 0), area)
+            chunk.set_clip(area)
+            for block in blocks:
+                chunk.blit(block.image, (block.rect.x - ox, block.rect.y - oy))
+            chunk.set_clip(None)
+
+    def draw(self, win, offset_x):
+        """
+        Draw the visible terrain chunks.
+
+        Args:
+            win (pygame.Surface): Game window surface.
+            offset_x (int): Camera x-offset for side scrolling.
+        """
+        view = pygame.Rect(offset_x, 0, win.get_width(), win.get_height())
+        size = self.chunk_size
+        for key in self._keys(view, size):
+            chunk = self.chunks.get(key)
+            if chunk is not None:
+                win.blit(chunk, (key[0] * size - offset_x, key[1] * size))
+
+
+# -------------------- Particles --------------------
+class ParticleSystem:
     """
-    Draw the background, objects, and player to the screen.
+    Fixed-size pool of short-lived sprite particles (pickup sparkles, dust).
 
-    Args:
-        window (pygame.Surface): Main game window.
-        background (list): List of background tile positions.
-        bg_image (pygame.Surface): Background image surface.
-        player (Player): The player object.
-        objects (list): List of all game objects.
-        offset_x (int): Camera x-offset.
+    Positions, velocities and lifetimes live in NumPy arrays, so the whole
+    pool advances in one vectorized step and every live particle is drawn
+    with a single Surface.blits call. Nothing is allocated per particle.
     """
-    for tile in background:
-        window.blit(bg_image, tile)
-    for obj in objects:
-        obj.draw(window, offset_x)
-    player.draw(window, offset_x)
-    pygame.display.update()
+    def __init__(self, capacity=10000, seed=None):
+        """
+        Preallocate the particle pool.
+
+        Args:
+            capacity (int): Maximum number of live particles.
+            seed (int, optional): Seed for the emission randomness.
+        """
+        self.capacity = capacity
+        self.pos = np.zeros((capacity, 2), np.float32)
+        self.vel = np.zeros((capacity, 2), np.float32)
+        self.gravity = np.zeros(capacity, np.float32)
+        self.life = np.zeros(capacity, np.int32)  # frames left, 0 means free
+        self.max_life = np.ones(capacity, np.int32)
+        self.kind = np.zeros(capacity, np.int32)
+        self.rng = np.random.default_rng(seed)
+        self.effects = {}
+        self._frames = []
+        self._frame_start = []
+        self._frame_count = []
+        self._half_size = []
+        self._frame_table = np.empty(0, dtype=object)
+        self.density = 1.0  # fraction of each requested burst that is spawned
+
+    def add_effect(self, name, frames):
+        """
+        Register an animation that particles can be emitted with.
+
+        Frames are switched to RLE acceleration, which roughly halves the
+        cost of blitting mostly transparent sprites.
+
+        Args:
+            name (str): Effect name used by emit().
+            frames (list): Pygame surfaces played over a particle's lifetime.
+        """
+        for frame in frames:
+            frame.set_alpha(255, pygame.RLEACCEL)
+        self.effects[name] = len(self._frame_start)
+        self._frame_start.append(len(self._frames))
+        self._frame_count.append(len(frames))
+        self._half_size.append((frames[0].get_width() // 2, frames[0].get_height() // 2))
+        self._frames.extend(frames)
+        self._frame_table = np.empty(len(self._frames), dtype=object)
+        self._frame_table[:] = self._frames
+        self._starts = np.array(self._frame_start, np.int32)
+        self._counts = np.array(self._frame_count, np.int32)
+        self._halves = np.array(self._half_size, np.int32)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.life))
+
+    def emit(self, name, x, y, count, speed=3.0, life=30, angle=-math.pi / 2,
+             spread=2 * math.pi, gravity=0.0):
+        """
+        Spawn a burst of particles at a world position.
+
+        Args:
+            name (str): Registered effect name.
+            x (float): World x-position of the burst.
+            y (float): World y-position of the burst.
+            count (int): Number of particles to spawn at full density.
+            speed (float): Maximum initial speed.
+            life (int): Lifetime in frames.
+            angle (float): Center direction of the burst in radians.
+            spread (float): Width of the burst cone in radians.
+            gravity (float): Downward acceleration per frame.
+
+        Returns:
+            int: Number of particles actually spawned (the pool may be full).
+        """
+        if count > 0:
+            count = max(1, int(round(count * self.density)))
+        slots = np.flatnonzero(self.life == 0)[:count]
+        n = len(slots)
+        if n == 0:
+            return 0
+        angles = angle + self.rng.uniform(-spread / 2, spread / 2, n)
+        speeds = self.rng.uniform(0.3, 1.0, n) * speed
+        self.pos[slots] = (x, y)
+        self.vel[slots, 0] = np.cos(angles) * speeds
+        self.vel[slots, 1] = np.sin(angles) * speeds
+        self.gravity[slots] = gravity
+        self.life[slots] = life
+        self.max_life[slots] = life
+        self.kind[slots] = self.effects[name]
+        return n
+
+    def update(self):
+        """
+        Advance every particle by one frame.
+        """
+        self.vel[:, 1] += self.gravity
+        self.pos += self.vel
+        np.subtract(self.life, 1, out=self.life, where=self.life > 0)
+
+    def clear(self):
+        """
+        Kill every live particle.
+        """
+        self.life[:] = 0
+
+    def bounds(self, offset_x):
+        """
+        Get the screen area covered by live particles.
+
+        Args:
+            offset_x (int): Camera x-offset for side scrolling.
+
+        Returns:
+            pygame.Rect: Bounding rect of every live particle frame, or None.
+        """
+        alive = np.flatnonzero(self.life > 0)
+        if len(alive) == 0:
+            return None
+        points = self.pos[alive].astype(np.int32)
+        halves = self._halves[self.kind[alive]]
+        left, top = (points - halves).min(axis=0)
+        right, bottom = (points + halves).max(axis=0) + 1
+        return pygame.Rect(left - offset_x, top, right - left, bottom - top)
+
+    def draw(self, win, offset_x):
+        """
+        Draw all live, on-screen particles with one batched blit.
 
-def handle_vertical_collision(player, objects, dy):
+        Args:
+            win (pygame.Surface): Game window surface.
+            offset_x (int): Camera x-offset for side scrolling.
+        """
+        x, y = self.pos[:, 0] - offset_x, self.pos[:, 1]
+        width, height = win.get_size()
+        margin = 64
+        alive = np.flatnonzero((self.life > 0) & (x > -margin) & (x < width + margin)
+                               & (y > -margin) & (y < height + margin))
+        if len(alive) == 0:
+            return
+        kind = self.kind[alive]
+        max_life = self.max_life[alive]
+        age = max_life - self.life[alive]
+        frames = self._starts[kind] + age * self._counts[kind] // max_life
+        points = self.pos[alive].astype(np.int32) - self._halves[kind]
+        points[:, 0] -= offset_x
+        win.blits(zip(self._frame_table[frames], points.tolist()), doreturn=False)
+
+
+def load_frames(dir1, dir2, name, width, height):
     """
-    Handle vertical collisions between the player and objects.
+    Load a single sprite sheet and split it into scaled frames.
 
     Args:
-        player (Player): Player sprite.
-        objects (list): List of objects to collide with.
-        dy (float): Player's vertical movement amount.
+        dir1 (str): Main asset directory.
+        dir2 (str): Subdirectory for the sheet.
+        name (str): Sprite sheet filename.
+        width (int): Width of each frame.
+        height (int): Height of each frame.
 
     Returns:
-        list: Objects that the player collided with vertically.
+        list: Scaled frames from left to right.
     """
-    collided_objects = []
-    for obj in objects:
-        if pygame.sprite.collide_mask(player, obj):
-            if dy > 0:
-                player.rect.bottom = obj.rect.top
-                player.landed()
-            elif dy < 0:
-                player.rect.top = obj.rect.bottom
-                player.hit_head()
-            collided_objects.append(obj)
-    return collided_objects
+    path = join(BASE_DIR, "assets", dir1, dir2, name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Cannot find sprite sheet: {path}")
+    sprite_sheet = pygame.image.load(path).convert_alpha()
+    frames = []
+    for i in range(max(1, sprite_sheet.get_width() // width)):
+        surface = pygame.Surface((width, height), pygame.SRCALPHA, 32)
+        surface.blit(sprite_sheet, (0, 0), pygame.Rect(i * width, 0, width, height))
+        frames.append(pygame.transform.scale2x(surface))
+    return frames
+
 
-def collide(player, objects, dx):
+def create_particles(capacity=10000):
     """
-    Check if the player would collide with something when moving horizontally.
+    Build the particle system with the pickup and landing effects.
 
     Args:
-        player (Player): Player sprite.
-        objects (list): Objects to check collision against.
-        dx (int): Horizontal movement amount.
+        capacity (int): Maximum number of live particles.
 
     Returns:
-        Object or None: The object collided with (if any).
+        ParticleSystem: System with "collected", "confetti" and "dust" effects.
     """
-    player.move(dx, 0)
-    player.update()
-    collided_object = None
-    for obj in objects:
-        if pygame.sprite.collide_mask(player, obj):
-            collided_object = obj
-            break
-    player.move(-dx, 0)
-    player.update()
-    return collided_object
+    particles = ParticleSystem(capacity)
+    particles.add_effect("collected", load_frames("Items", "Fruits", "Collected.png", 32, 32))
+    particles.add_effect("confetti", load_frames("Other", "", "Confetti (16x16).png", 16, 16))
+    particles.add_effect("dust", load_frames("Other", "", "Dust Particle.png", 16, 16))
+    return particles
 
-def handle_move(player, objects):
+
+def emit_pickup(particles, x, y):
     """
-    Handle player movement input and collision checks.
+    Emit the sparkle and confetti burst for a collected mango.
+    """
+    particles.emit("collected", x, y, 1, speed=0, life=18)
+    particles.emit("confetti", x, y, 16, speed=6, life=40, gravity=0.3)
 
-    Also handles interactions like getting hit by fire or collecting mangoes.
 
-    Args:
-        player (Player): Player object.
-        objects (list): List of all game objects.
+def emit_landing(particles, x, y):
     """
-    keys = pygame.key.get_pressed()
-    player.x_vel = 0
-    collide_left = collide(player, objects, -PLAYER_VEL * 2)
-    collide_right = collide(player, objects, PLAYER_VEL * 2)
+    Emit the dust puff shown when the player lands.
+    """
+    particles.emit("dust", x, y, 8, speed=2, life=20, spread=math.pi * 0.8)
+
+
+# -------------------- Hazard Scheduler --------------------
+class TimerWheel:
+    """
+    Hashed timing wheel that runs callbacks after a number of ticks.
+
+    Timers are dropped into the slot they expire in, so advancing the
+    wheel only looks at one slot instead of polling every timer.
+    """
+    def __init__(self, slots=256):
+        """
+        Create an empty wheel.
+
+        Args:
+            slots (int): Number of slots; longer delays wrap around in rounds.
+        """
+        self.slots = [[] for _ in range(slots)]
+        self.tick_count = 0
+
+    def schedule(self, delay, callback):
+        """
+        Run a callback after a number of ticks.
+
+        Args:
+            delay (int): Ticks to wait (at least 1).
+            callback (callable): Function called with no arguments.
+        """
+        delay = max(1, int(delay))
+        size = len(self.slots)
+        slot = (self.tick_count + delay) % size
+        self.slots[slot].append([(delay - 1) // size, callback])
+
+    def advance(self):
+        """
+        Move the wheel forward one tick and run the timers that expired.
+        """
+        self.tick_count += 1
+        slot = self.slots[self.tick_count % len(self.slots)]
+        if not slot:
+            return
+        due = []
+        waiting = []
+        for entry in slot:
+            if entry[0] == 0:
+                due.append(entry[1])
+            else:
+                entry[0] -= 1
+                waiting.append(entry)
+        slot[:] = waiting
+        for callback in due:
+            callback()
+
+
+class HazardScheduler:
+    """
+    Drives trap animations and on/off cycles.
+
+    Traps are bucketed into columns so only the ones near the camera or
+    the player are animated each frame. On/off cycles run on a TimerWheel.
+    Animation phase comes from ANIMATION_CLOCK, so a trap that wakes up
+    shows the right frame without being fast-forwarded.
+    """
+    def __init__(self, column_width=256, wake_margin=200, wheel_slots=256):
+        """
+        Create an empty scheduler.
+
+        Args:
+            column_width (int): Width of the spatial buckets traps are stored in.
+            wake_margin (int): Extra distance around the view that keeps traps awake.
+            wheel_slots (int): Number of slots in the timer wheel.
+        """
+        self.column_width = column_width
+        self.wake_margin = wake_margin
+        self.wheel = TimerWheel(wheel_slots)
+        self.columns = {}
+        self.column_of = {}
+        self.traps = set()
+        self.cycles = {}     # trap -> (on_ticks, off_ticks)
+        self.deadlines = {}  # trap -> wheel tick of its next toggle
+        self.tick_count = 0
+        self.far_stride = 1  # off-screen traps animate every far_stride ticks
+
+    def __len__(self):
+        return len(self.traps)
+
+    def add(self, trap, on_ticks=None, off_ticks=None):
+        """
+        Register a trap and optionally start an on/off cycle for it.
+
+        Args:
+            trap (Fire): Trap with loop() and toggle() methods.
+            on_ticks (int, optional): Ticks the trap stays on each cycle.
+            off_ticks (int, optional): Ticks the trap stays off each cycle.
+        """
+        column = trap.rect.centerx // self.column_width
+        self.columns.setdefault(column, []).append(trap)
+        self.column_of[trap] = column
+        self.traps.add(trap)
+        if on_ticks and off_ticks:
+            self.cycles[trap] = (on_ticks, off_ticks)
+            self._schedule_toggle(trap, on_ticks if trap.animation_name == "on" else off_ticks)
+
+    def remove(self, trap):
+        """
+        Stop animating a trap and cancel its on/off cycle.
+
+        Args:
+            trap (Fire): Trap to remove.
+        """
+        column = self.column_of.pop(trap, None)
+        traps = self.columns.get(column, [])
+        if trap in traps:
+            traps.remove(trap)
+            if not traps:
+                del self.columns[column]
+        self.traps.discard(trap)
+        self.cycles.pop(trap, None)
+        self.deadlines.pop(trap, None)
+
+    def toggle_delay(self, trap):
+        """
+        Get how many ticks are left until a trap next toggles.
+
+        Args:
+            trap (Fire): Registered trap.
+
+        Returns:
+            int: Ticks until the toggle, or 0 if the trap has no on/off cycle.
+        """
+        deadline = self.deadlines.get(trap)
+        return 0 if deadline is None else deadline - self.wheel.tick_count
+
+    def reschedule(self, trap, delay):
+        """
+        Move a trap's next toggle, keeping its on/off cycle.
+
+        Args:
+            trap (Fire): Trap with an on/off cycle; others are ignored.
+            delay (int): Ticks until the next toggle.
+        """
+        if trap in self.cycles:
+            self._schedule_toggle(trap, delay)
+
+    def _schedule_toggle(self, trap, delay):
+        delay = max(1, int(delay))
+        deadline = self.deadlines[trap] = self.wheel.tick_count + delay
+
+        def toggle():
+            if self.deadlines.get(trap) != deadline:
+                return  # removed or rescheduled since
+            trap.toggle()
+            on_ticks, off_ticks = self.cycles[trap]
+            self._schedule_toggle(trap, on_ticks if trap.animation_name == "on" else off_ticks)
+
+        self.wheel.schedule(delay, toggle)
+
+    def active_traps(self, player, offset_x, view_width=WIDTH):
+        """
+        Get the traps close enough to the camera or player to animate.
+
+        Args:
+            player (Player): The player sprite.
+            offset_x (int): Camera x-offset.
+            view_width (int): Width of the visible area.
+
+        Returns:
+            list: Traps that should be ticked this frame.
+        """
+        left = min(offset_x, player.rect.left) - self.wake_margin
+        right = max(offset_x + view_width, player.rect.right) + self.wake_margin
+        traps = []
+        for column in range(left // self.column_width, right // self.column_width + 1):
+            traps.extend(self.columns.get(column, ()))
+        return traps
+
+    def update(self, player, offset_x, view_width=WIDTH):
+        """
+        Advance the timer wheel and animate the traps near the view.
+
+        Args:
+            player (Player): The player sprite.
+            offset_x (int): Camera x-offset.
+            view_width (int): Width of the visible area.
+        """
+        self.tick_count += 1
+        self.wheel.advance()
+        skip_far = self.far_stride > 1 and self.tick_count % self.far_stride
+        for trap in self.active_traps(player, offset_x, view_width):
+            if skip_far and not offset_x <= trap.rect.centerx < offset_x + view_width:
+                continue
+            trap.loop()
+
+
+# -------------------- Quality Governor --------------------
+class QualityGovernor:
+    """
+    Watches frame times and steps quality down when frames run over budget.
+
+    Each tier keeps the savings of the tiers below it. The governor moves
+    at most one tier per cooldown period and only restores quality once the
+    smoothed frame time falls well under the budget, so it does not flap.
+    """
+    TIERS = (
+        "full",                # everything on
+        "slow_far_animation",  # off-screen traps animate every few ticks
+        "aabb_reject",         # a rect test skips the mask test for objects not overlapping
+        "low_particles",       # fewer particles per burst
+        "solid_background",    # background tiles replaced by a fill
+    )
+
+    def __init__(self, budget_ms=1000 / FPS, degrade_at=1.0, restore_at=0.7,
+                 smoothing=0.1, cooldown=30):
+        """
+        Create a governor that starts at full quality.
+
+        Args:
+            budget_ms (float): Frame time budget in milliseconds.
+            degrade_at (float): Step down when smoothed frame time exceeds budget * degrade_at.
+            restore_at (float): Step up when smoothed frame time drops below budget * restore_at.
+            smoothing (float): Weight of the newest sample in the moving average.
+            cooldown (int): Frames to wait after a tier change before changing again.
+        """
+        self.budget_ms = budget_ms
+        self.degrade_at = degrade_at
+        self.restore_at = restore_at
+        self.smoothing = smoothing
+        self.cooldown = cooldown
+        self.frame_ms = 0.0
+        self.tier = 0
+        self.frames_since_change = 0
+
+    @property
+    def tier_name(self):
+        return self.TIERS[self.tier]
+
+    @property
+    def far_animation_stride(self):
+        return 4 if self.tier >= 1 else 1
+
+    @property
+    def rect_reject(self):
+        return self.tier >= 2
+
+    @property
+    def particle_density(self):
+        return 0.25 if self.tier >= 3 else 1.0
+
+    @property
+    def solid_background(self):
+        return self.tier >= 4
+
+    def record(self, frame_ms):
+        """
+        Feed the time spent on the last frame and adjust the tier.
+
+        Args:
+            frame_ms (float): Work time of the last frame in milliseconds.
+
+        Returns:
+            int: The active tier.
+        """
+        self.frame_ms += (frame_ms - self.frame_ms) * self.smoothing
+        self.frames_since_change += 1
+        if self.frames_since_change < self.cooldown:
+            return self.tier
+        if self.frame_ms > self.budget_ms * self.degrade_at and self.tier < len(self.TIERS) - 1:
+            self.tier += 1
+            self.frames_since_change = 0
+        elif self.frame_ms < self.budget_ms * self.restore_at and self.tier > 0:
+            self.tier -= 1
+            self.frames_since_change = 0
+        return self.tier
+
+    def apply(self, hazards, particles):
+        """
+        Push the settings of the active tier into the systems that use them.
+
+        Args:
+            hazards (HazardScheduler): Trap scheduler.
+            particles (ParticleSystem): Particle system.
+        """
+        hazards.far_stride = self.far_animation_stride
+        particles.density = self.particle_density
+
+
+# -------------------- Background --------------------
+def get_background(name):
+    """
+    Load and tile the background image across the window.
+
+    Args:
+        name (str): Background image filename.
+
+    Returns:
+        tuple: (tiles, image) where tiles is a list of positions to blit,
+               and image is the loaded background surface.
+    """
+    path = join(BASE_DIR, "assets", "Background", name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Cannot find background: {path}")
+    image = pygame.image.load(path)
+    _, _, width, height = image.get_rect()
+    tiles = []
+
+    for i in range(WIDTH // width + 1):
+        for j in range(HEIGHT // height + 1):
+            pos = (i * width, j * height)
+            tiles.append(pos)
+
+    return tiles, image
+
+# -------------------- Game Loop Helpers --------------------
+def render_background(window, background, bg_image, offset_x, terrain=None):
+    """
+    Draw the background and terrain layers, which do not change between
+    frames while the camera stands still.
+
+    Args:
+        window (pygame.Surface): Main game window.
+        background (list): List of background tile positions.
+        bg_image (pygame.Surface): Background image surface, or None for a solid fill.
+        offset_x (int): Camera x-offset.
+        terrain (TerrainGrid, optional): Pre-rendered terrain.
+    """
+    if bg_image is None:
+        window.fill(BACKGROUND_FILL)
+    else:
+        for tile in background:
+            window.blit(bg_image, tile)
+    if terrain is not None:
+        terrain.draw(window, offset_x)
+
+def render_scene(window, background, bg_image, player, objects, offset_x, terrain=None,
+                 particles=None):
+    """
+    Draw the background, objects, and player onto a surface without presenting it.
+
+    Args:
+        window (pygame.Surface): Main game window.
+        background (list): List of background tile positions.
+        bg_image (pygame.Surface): Background image surface, or None for a solid fill.
+        player (Player): The player object.
+        objects (list): List of all game objects.
+        offset_x (int): Camera x-offset.
+        terrain (TerrainGrid, optional): Pre-rendered terrain drawn under the objects.
+        particles (ParticleSystem, optional): Effects drawn over the player.
+    """
+    render_background(window, background, bg_image, offset_x, terrain)
+    for obj in objects:
+        obj.draw(window, offset_x)
+    player.draw(window, offset_x)
+    if particles is not None:
+        particles.draw(window, offset_x)
+
+def draw(window, background, bg_image, player, objects, offset_x, terrain=None,
+         particles=None):
+    """
+    Draw the background, objects, and player to the screen.
+
+    Takes the same arguments as render_scene() and then updates the display.
+    """
+    render_scene(window, background, bg_image, player, objects, offset_x, terrain, particles)
+    display.present()
+
+class DirtyRenderer:
+    """
+    Draws frames with dirty-rectangle display updates.
+
+    While the camera stands still, background and terrain come from a
+    cached surface and only entities that moved, changed frame, appeared or
+    disappeared are redrawn; just their old and new rects are sent to the
+    display. A scrolling camera, a terrain or background change, or too
+    many dirty rects falls back to a full redraw.
+    """
+    def __init__(self, max_rects=32, max_area=0.5):
+        """
+        Create a renderer with an empty cache.
+
+        Args:
+            max_rects (int): Most dirty rects before a full redraw is cheaper.
+            max_area (float): Largest fraction of the screen that may be dirty.
+        """
+        self.max_rects = max_rects
+        self.max_area = max_area
+        self.cache = None
+        self.cache_key = None
+        self.last_offset = None
+        self.drawn = {}  # entity -> (surface, screen rect) drawn last frame
+        self.full_redraws = 0
+
+    def invalidate(self):
+        """
+        Force the next frame to be a full redraw.
+        """
+        self.cache_key = None
+        self.last_offset = None
+
+    def draw(self, window, background, bg_image, player, objects, offset_x, terrain=None,
+             particles=None):
+        """
+        Draw a frame and update the changed parts of the display.
+
+        Takes the same arguments as draw().
+
+        Returns:
+            list: Rects sent to the display, or None after a full redraw.
+        """
+        visible = self._visible(window, player, objects, offset_x, particles)
+        cache_key = (offset_x, id(bg_image), terrain.revision if terrain else None,
+                     id(window))
+        if offset_x != self.last_offset:
+            # Scrolling: render straight to the window and build the cache
+            # only once the camera settles.
+            self.last_offset = offset_x
+            self.cache_key = None
+            return self._full(window, background, bg_image, player, objects, offset_x,
+                              terrain, particles, visible)
+        if cache_key != self.cache_key:
+            if self.cache is None or self.cache.get_size() != window.get_size():
+                self.cache = pygame.Surface(window.get_size()).convert()
+            render_background(self.cache, background, bg_image, offset_x, terrain)
+            self.cache_key = cache_key
+            # Whatever changed in the cache may be anywhere on screen.
+            return self._from_cache(window, offset_x, visible)
+
+        dirty = self._dirty(window, visible)
+        if dirty is None:
+            return self._from_cache(window, offset_x, visible)
+
+        for area in dirty:
+            window.set_clip(area)
+            window.blit(self.cache, area, area)
+            for entity, (surface, rect) in visible.items():
+                if rect.colliderect(area):
+                    self._draw_entity(window, entity, surface, rect, offset_x)
+        window.set_clip(None)
+        self.drawn = visible
+        display.present(dirty)
+        return dirty
+
+    def _full(self, window, background, bg_image, player, objects, offset_x, terrain,
+              particles, visible):
+        render_scene(window, background, bg_image, player, objects, offset_x, terrain,
+                     particles)
+        self.drawn = visible
+        self.full_redraws += 1
+        display.present()
+        return None
+
+    def _from_cache(self, window, offset_x, visible):
+        window.blit(self.cache, (0, 0))
+        for entity, (surface, rect) in visible.items():
+            self._draw_entity(window, entity, surface, rect, offset_x)
+        self.drawn = visible
+        self.full_redraws += 1
+        display.present()
+        return None
+
+    @staticmethod
+    def _visible(window, player, objects, offset_x, particles):
+        screen = window.get_rect()
+        visible = {}
+        for obj in objects:
+            rect = obj.image.get_rect(topleft=(obj.rect.x - offset_x, obj.rect.y))
+            if rect.colliderect(screen):
+                visible[obj] = (obj.image, rect)
+        visible[player] = (player.sprite, player.sprite.get_rect(
+            topleft=(player.rect.x - offset_x, player.rect.y)))
+        if particles is not None:
+            bounds = particles.bounds(offset_x)
+            if bounds is not None:
+                visible[particles] = (None, bounds.clip(screen))
+        return visible
+
+    def _dirty(self, window, visible):
+        dirty = []
+        for entity, (surface, rect) in visible.items():
+            old = self.drawn.get(entity)
+            if old is None:
+                dirty.append(rect)
+            elif surface is None or old[0] is not surface or old[1] != rect:
+                if old[1].colliderect(rect):
+                    dirty.append(old[1].union(rect))
+                else:
+                    dirty.extend((old[1], rect))
+        for entity, (surface, rect) in self.drawn.items():
+            if entity not in visible:
+                dirty.append(rect)
+
+        screen = window.get_rect()
+        dirty = [rect.clip(screen) for rect in dirty]
+        dirty = [rect for rect in dirty if rect.w and rect.h]
+        if len(dirty) > self.max_rects or \
+                sum(rect.w * rect.h for rect in dirty) > screen.w * screen.h * self.max_area:
+            return None
+        return dirty
+
+    @staticmethod
+    def _draw_entity(window, entity, surface, rect, offset_x):
+        if surface is None:
+            entity.draw(window, offset_x)  # particle system
+        else:
+            window.blit(surface, rect)
+
+
+def touching(player, obj, rect_reject=False):
+    """
+    Check whether the player overlaps an object.
+
+    Args:
+        player (Player): Player sprite.
+        obj (Object): Object to test.
+        rect_reject (bool): If True, objects whose rect misses the player's
+            are rejected without the mask test. The result is the same, only
+            cheaper when most objects are not touching.
+
+    Returns:
+        bool: True if the two overlap.
+    """
+    if rect_reject and not player.rect.colliderect(obj.rect):
+        return False
+    return pygame.sprite.collide_mask(player, obj) is not None
+
+def handle_vertical_collision(player, objects, dy, particles=None, rect_reject=False):
+    """
+    Handle vertical collisions between the player and objects.
+
+    Args:
+        player (Player): Player sprite.
+        objects (list): List of objects to collide with.
+        dy (float): Player's vertical movement amount.
+        particles (ParticleSystem, optional): Receives a dust burst on hard landings.
+        rect_reject (bool): Skip the mask test for objects whose rect misses
+            the player's; see touching().
+
+    Returns:
+        list: Objects that the player collided with vertically.
+    """
+    collided_objects = []
+    for obj in objects:
+        if touching(player, obj, rect_reject):
+            if dy > 0:
+                player.rect.bottom = obj.rect.top
+                if particles is not None and player.y_vel >= LANDING_DUST_SPEED:
+                    emit_landing(particles, player.rect.centerx, player.rect.bottom)
+                player.landed()
+            elif dy < 0:
+                player.rect.top = obj.rect.bottom
+                player.hit_head()
+            collided_objects.append(obj)
+    return collided_objects
+
+def collide(player, objects, dx, rect_reject=False):
+    """
+    Check if the player would collide with something when moving horizontally.
+
+    Args:
+        player (Player): Player sprite.
+        objects (list): Objects to check collision against.
+        dx (int): Horizontal movement amount.
+        rect_reject (bool): Skip the mask test for objects whose rect misses
+            the player's; see touching().
+
+    Returns:
+        Object or None: The object collided with (if any).
+    """
+    player.move(dx, 0)
+    player.update()
+    collided_object = None
+    for obj in objects:
+        if touching(player, obj, rect_reject):
+            collided_object = obj
+            break
+    player.move(-dx, 0)
+    player.update()
+    return collided_object
+
+def handle_move(player, objects, terrain=None, particles=None, rect_reject=False,
+                keys=None):
+    """
+    Handle player movement input and collision checks.
+
+    Also handles interactions like getting hit by fire or collecting mangoes.
+
+    Args:
+        player (Player): Player object.
+        objects (list): List of all game objects.
+        terrain (TerrainGrid, optional): Terrain blocks; only the ones near
+            the player are checked.
+        particles (ParticleSystem, optional): Receives pickup and landing bursts.
+        rect_reject (bool): Skip the mask test for objects whose rect misses
+            the player's (AABB); collisions come out the same.
+        keys (mapping, optional): Key states indexed by pygame key constant.
+            Defaults to the keyboard (pygame.key.get_pressed()).
+    """
+    if keys is None:
+        keys = pygame.key.get_pressed()
+    nearby = objects
+    if terrain is not None:
+        area = player.rect.inflate(PLAYER_VEL * 4, PLAYER_VEL * 4)
+        nearby = terrain.query(area) + objects
+    player.x_vel = 0
+    collide_left = collide(player, nearby, -PLAYER_VEL * 2, rect_reject)
+    collide_right = collide(player, nearby, PLAYER_VEL * 2, rect_reject)
+
+    if keys[pygame.K_LEFT] and not collide_left:
+        player.move_left(PLAYER_VEL)
+    if keys[pygame.K_RIGHT] and not collide_right:
+        player.move_right(PLAYER_VEL)
+
+    vertical_collide = handle_vertical_collision(player, nearby, player.y_vel, particles,
+                                                 rect_reject)
+    to_check = [collide_left, collide_right, *vertical_collide]
+    for obj in to_check:
+        if obj:
+            if obj.name == "fire":
+                obj.damage(player)
+            elif obj.name == "mango" and not obj.collected:
+                objects.remove(obj)
+                obj.collected = True
+                player.score += 1
+                if particles is not None:
+                    emit_pickup(particles, *obj.rect.center)
+                print(f"Mango collected! Score: {player.score}")
+
+# -------------------- Level --------------------
+class Level:
+    """
+    Container for the player and every entity in one playable level.
+    """
+    def __init__(self, player, blocks, mangoes, fires, block_size=96):
+        """
+        Build the terrain grid, object list and trap scheduler for a level.
+
+        Args:
+            player (Player): The player sprite.
+            blocks (list): Terrain blocks.
+            mangoes (list): Collectible mangoes, in a fixed order.
+            fires (list): Fire traps, in a fixed order.
+            block_size (int): Size of a terrain block (used as the grid cell size).
+        """
+        self.player = player
+        self.block_size = block_size
+        self.terrain = TerrainGrid(block_size)
+        for block in blocks:
+            self.terrain.add(block)
+        self.mangoes = list(mangoes)
+        self.fires = list(fires)
+        self.objects = [*self.mangoes, *self.fires]
+        self.hazards = HazardScheduler()
+        self.offset_x = 0
+
+    def update_camera(self, scroll_area_width=200):
+        """
+        Scroll the camera when the player runs into the edge of the view.
+
+        Args:
+            scroll_area_width (int): Width of the scroll zones at each side.
+        """
+        player = self.player
+        if ((player.rect.right - self.offset_x >= WIDTH - scroll_area_width) and player.x_vel > 0) or \
+           ((player.rect.left - self.offset_x <= scroll_area_width) and player.x_vel < 0):
+            self.offset_x += player.x_vel
+
+    def remaining_mangoes(self):
+        """
+        Get the mangoes that have not been collected yet.
+
+        Returns:
+            list: Uncollected mangoes.
+        """
+        return [mango for mango in self.mangoes if not mango.collected]
+
+
+def default_layout(block_size=96):
+    """
+    Describe the default Mango Masters level as plain data.
+
+    Args:
+        block_size (int): Size of a terrain block.
+
+    Returns:
+        dict: Layout with "block_size", "player" (x, y), "blocks" [(x, y)],
+              "mangoes" [(x, y, width, height)] and "fires" [(x, y, width, height)].
+    """
+    floor = [(i * block_size, HEIGHT - block_size) for i in range(-5, 40)]
+
+    # -------------------- PLATFORMS --------------------
+    platforms = [
+        (200, HEIGHT - block_size * 2),
+        (350, HEIGHT - block_size * 3),
+
+        (500, HEIGHT - block_size * 4),
+        (600, HEIGHT - block_size * 4),
+        (700, HEIGHT - block_size * 4),
+
+        (900, HEIGHT - block_size * 3),
+    ]
+
+    # -------------------- MANGOES --------------------
+    mangoes = [
+        (520, HEIGHT - block_size * 4 - 60, 50, 50),
+        (620, HEIGHT - block_size * 4 - 60, 50, 50),
+        (720, HEIGHT - block_size * 4 - 60, 50, 50),
+
+        (360, HEIGHT - block_size * 3 - 60, 50, 50),
+        (920, HEIGHT - block_size * 3 - 60, 50, 50),
+
+        (600, HEIGHT - block_size - 60, 50, 50),
+        (1100, HEIGHT - block_size - 60, 50, 50),
+    ]
+
+    return {
+        "block_size": block_size,
+        "player": (100, HEIGHT - block_size * 2),
+        "blocks": [*floor, *platforms],
+        "mangoes": mangoes,
+        "fires": [(1400, HEIGHT - block_size - 64, 16, 32)],
+    }
+
+
+def build_level(layout=None):
+    """
+    Create a playable level from a layout.
+
+    Args:
+        layout (dict, optional): Layout in the default_layout() format.
+            Defaults to the default Mango Masters level.
+
+    Returns:
+        Level: The level with its player, terrain, mangoes and fires.
+    """
+    if layout is None:
+        layout = default_layout()
+    block_size = layout["block_size"]
+    player = Player(*layout["player"], 50, 50)
+    blocks = [Block(x, y, block_size) for x, y in layout["blocks"]]
+    mangoes = [Mango(*rect) for rect in layout["mangoes"]]
+    fires = [Fire(*rect) for rect in layout["fires"]]
+
+    level = Level(player, blocks, mangoes, fires, block_size)
+    start_hazards(level)
+    return level
+
+
+def start_hazards(level):
+    """
+    Give a level a fresh trap scheduler with every fire starting its on/off cycle.
+
+    Args:
+        level (Level): Level whose fires should be scheduled.
+    """
+    level.hazards = HazardScheduler()
+    for fire in level.fires:
+        fire.on()
+        level.hazards.add(fire, on_ticks=FPS * 2, off_ticks=FPS)
+
+# -------------------- Snapshots --------------------
+Snapshot = namedtuple("Snapshot", [
+    "x", "y", "x_vel", "y_vel", "direction",
+    "animation_count", "fall_count", "jump_count", "hit", "hit_count",
+    "score", "collected", "fires", "offset_x",
+])
+Snapshot.__doc__ = """
+Immutable copy of the game state that changes while playing.
+
+Only numbers are stored, never surfaces. collected is a bitmask over
+Level.mangoes and fires is a tuple of (animation_name, animation_count,
+toggle_delay) triples in Level.fires order, toggle_delay being the ticks
+until the fire's next on/off switch (0 if it has no cycle).
+"""
+
+SNAPSHOT_MAGIC = b"MMSV"
+SNAPSHOT_VERSION = 2
+_SNAPSHOT_HEADER = struct.Struct("<4sB")
+_SNAPSHOT_BODY = struct.Struct("<iiddBiiiBiiiII")
+_SNAPSHOT_FIRE = struct.Struct("<Bii")
+
+
+def capture_snapshot(level):
+    """
+    Capture the current state of a level.
+
+    Args:
+        level (Level): Level to capture.
+
+    Returns:
+        Snapshot: State of the player, mangoes, fires and camera.
+    """
+    player = level.player
+    collected = 0
+    for i, mango in enumerate(level.mangoes):
+        if mango.collected:
+            collected |= 1 << i
+    return Snapshot(
+        player.rect.x, player.rect.y, player.x_vel, player.y_vel, player.direction,
+        player.animation_count, player.fall_count, player.jump_count,
+        player.hit, player.hit_count, player.score, collected,
+        tuple((fire.animation_name, fire.animation_count, level.hazards.toggle_delay(fire))
+              for fire in level.fires),
+        level.offset_x,
+    )
+
+
+def restore_snapshot(level, snapshot):
+    """
+    Put a level back into the state stored in a snapshot.
+
+    Args:
+        level (Level): Level to restore (must be the level the snapshot came from).
+        snapshot (Snapshot): State to restore.
+    """
+    player = level.player
+    player.rect.x, player.rect.y = snapshot.x, snapshot.y
+    player.x_vel, player.y_vel = snapshot.x_vel, snapshot.y_vel
+    player.direction = snapshot.direction
+    player.fall_count = snapshot.fall_count
+    player.jump_count = snapshot.jump_count
+    player.hit, player.hit_count = snapshot.hit, snapshot.hit_count
+    player.score = snapshot.score
+    player.animation_count = snapshot.animation_count
+    player.update_sprite()
+
+    for i, mango in enumerate(level.mangoes):
+        collected = bool(snapshot.collected >> i & 1)
+        if collected == mango.collected:
+            continue
+        mango.collected = collected
+        if collected:
+            level.objects.remove(mango)
+        else:
+            level.objects.append(mango)
+
+    for fire, (name, count, delay) in zip(level.fires, snapshot.fires):
+        fire.animation_name = name
+        fire.animation_count = count
+        fire.loop()
+        if delay:
+            level.hazards.reschedule(fire, delay)
+    level.offset_x = snapshot.offset_x
+
+
+def save_snapshot(path, snapshot):
+    """
+    Write a snapshot to disk in a compact binary format.
+
+    Args:
+        path (str): Destination file.
+        snapshot (Snapshot): Snapshot to save.
+    """
+    collected = snapshot.collected.to_bytes((snapshot.collected.bit_length() + 7) // 8, "little")
+    parts = [
+        _SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION),
+        _SNAPSHOT_BODY.pack(
+            snapshot.x, snapshot.y, snapshot.x_vel, snapshot.y_vel,
+            snapshot.direction == "right", snapshot.animation_count,
+            snapshot.fall_count, snapshot.jump_count, snapshot.hit,
+            snapshot.hit_count, snapshot.score, snapshot.offset_x,
+            len(snapshot.fires), len(collected),
+        ),
+        collected,
+    ]
+    parts.extend(_SNAPSHOT_FIRE.pack(name == "on", count, delay)
+                 for name, count, delay in snapshot.fires)
+    with open(path, "wb") as f:
+        f.write(b"".join(parts))
+
+
+def load_snapshot(path):
+    """
+    Read a snapshot written by save_snapshot().
+
+    Args:
+        path (str): Snapshot file.
+
+    Returns:
+        Snapshot: The stored snapshot.
+
+    Raises:
+        ValueError: If the file is not a snapshot, has an unknown version or
+            is truncated or corrupt.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < _SNAPSHOT_HEADER.size + _SNAPSHOT_BODY.size:
+        raise ValueError(f"Not a snapshot file: {path}")
+    magic, version = _SNAPSHOT_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(f"Not a snapshot file: {path}")
+    try:
+        (x, y, x_vel, y_vel, right, animation_count, fall_count, jump_count, hit,
+         hit_count, score, offset_x, fire_count, collected_len) = _SNAPSHOT_BODY.unpack_from(data, _SNAPSHOT_HEADER.size)
+        pos = _SNAPSHOT_HEADER.size + _SNAPSHOT_BODY.size
+        if len(data) != pos + collected_len + fire_count * _SNAPSHOT_FIRE.size:
+            raise ValueError(f"Truncated or corrupt snapshot file: {path}")
+        collected = int.from_bytes(data[pos:pos + collected_len], "little")
+        pos += collected_len
+        fires = tuple(
+            ("on" if on else "off", count, delay)
+            for on, count, delay in _SNAPSHOT_FIRE.iter_unpack(data[pos:])
+        )
+    except struct.error as error:
+        raise ValueError(f"Corrupt snapshot file: {path}") from error
+    return Snapshot(
+        x, y, x_vel, y_vel, "right" if right else "left", animation_count,
+        fall_count, jump_count, bool(hit), hit_count, score, collected, fires, offset_x,
+    )
+
+
+class RewindBuffer:
+    """
+    Ring buffer holding the most recent snapshots for rewinding.
+
+    Storage is allocated once; pushing past capacity overwrites the oldest
+    snapshot.
+    """
+    def __init__(self, seconds=5, fps=FPS):
+        """
+        Create an empty buffer.
+
+        Args:
+            seconds (float): How much play time to keep.
+            fps (int): Snapshots pushed per second.
+        """
+        self.frames = [None] * max(1, int(seconds * fps))
+        self.head = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def push(self, snapshot):
+        """
+        Store a snapshot as the newest entry.
+
+        Args:
+            snapshot (Snapshot): Snapshot to store.
+        """
+        self.frames[self.head] = snapshot
+        self.head = (self.head + 1) % len(self.frames)
+        self.size = min(self.size + 1, len(self.frames))
+
+    def pop(self):
+        """
+        Remove and return the newest snapshot.
+
+        Returns:
+            Snapshot or None: The newest snapshot, or None if the buffer is empty.
+        """
+        if self.size == 0:
+            return None
+        self.head = (self.head - 1) % len(self.frames)
+        self.size -= 1
+        snapshot = self.frames[self.head]
+        self.frames[self.head] = None
+        return snapshot
+
+    def clear(self):
+        """
+        Drop every stored snapshot.
+        """
+        self.frames = [None] * len(self.frames)
+        self.head = 0
+        self.size = 0
+
+
+# -------------------- Bot Environment --------------------
+# Each action is (left, right, jump).
+ACTIONS = (
+    (False, False, False),
+    (True, False, False),
+    (False, True, False),
+    (False, False, True),
+    (True, False, True),
+    (False, True, True),
+)
+NEARBY_OBJECTS = 4
+OBSERVATION_SIZE = 7 + NEARBY_OBJECTS * 4
+
+
+class MangoEnv:
+    """
+    Headless reset/step interface to one game for bots.
+
+    Observations are float32 vectors of OBSERVATION_SIZE: the player's
+    center, velocity, jump_count, hit flag and score, followed by the
+    offset, kind (1 mango, 2 fire) and active flag of the NEARBY_OBJECTS
+    closest uncollected mangoes and fires. render_frame() gives an optional
+    downscaled RGB view of the level.
+    """
+    def __init__(self, max_steps=FPS * 60, frame_size=None):
+        """
+        Build the level and remember its starting state.
+
+        Args:
+            max_steps (int): Steps before an episode is cut off.
+            frame_size (tuple, optional): (width, height) of render_frame() output.
+        """
+        self.max_steps = max_steps
+        self.frame_size = frame_size
+        self.level = build_level()
+        self.start = capture_snapshot(self.level)
+        self.canvas = pygame.Surface((WIDTH, HEIGHT)) if frame_size else None
+        self.steps = 0
+
+    def reset(self):
+        """
+        Start a new episode.
+
+        Returns:
+            numpy.ndarray: The first observation.
+        """
+        level = self.level
+        restore_snapshot(level, self.start)
+        # Restoring re-adds collected mangoes at the end; put the object
+        # order back too so every episode plays out the same.
+        level.objects[:] = [*level.mangoes, *level.fires]
+        self.steps = 0
+        return self.observe()
+
+    def step(self, action):
+        """
+        Advance the game by one frame.
+
+        Args:
+            action (int): Index into ACTIONS.
+
+        Returns:
+            tuple: (observation, reward, done, info). Reward is +1 per mango
+            collected and -1 each time the player gets hit.
+        """
+        left, right, jump = ACTIONS[action]
+        level = self.level
+        player = level.player
+        score, was_hit = player.score, player.hit
+
+        ANIMATION_CLOCK.advance()
+        if jump and player.jump_count < 2:
+            player.jump()
+        player.loop(FPS)
+        level.hazards.update(player, level.offset_x)
+        handle_move(player, level.objects, level.terrain,
+                    keys={pygame.K_LEFT: left, pygame.K_RIGHT: right})
+        level.update_camera()
+        self.steps += 1
+
+        reward = player.score - score - (player.hit and not was_hit)
+        won = not level.remaining_mangoes()
+        fell = player.rect.top > HEIGHT * 2
+        done = won or fell or self.steps >= self.max_steps
+        return self.observe(), float(reward), done, {"won": won, "fell": fell}
+
+    def observe(self, out=None):
+        """
+        Write the current observation into a buffer.
+
+        Args:
+            out (numpy.ndarray, optional): float32 buffer of OBSERVATION_SIZE.
+
+        Returns:
+            numpy.ndarray: The filled buffer.
+        """
+        if out is None:
+            out = np.zeros(OBSERVATION_SIZE, np.float32)
+        player = self.level.player
+        px, py = player.rect.center
+        out[:7] = (px, py, player.x_vel, player.y_vel, player.jump_count,
+                   player.hit, player.score)
+        out[7:] = 0
+        targets = [obj for obj in self.level.objects if obj.name in ("mango", "fire")]
+        targets = heapq.nsmallest(
+            NEARBY_OBJECTS, targets,
+            key=lambda obj: abs(obj.rect.centerx - px) + abs(obj.rect.centery - py),
+        )
+        for i, obj in enumerate(targets):
+            kind = 1 if obj.name == "mango" else 2
+            active = obj.name == "mango" or obj.animation_name == "on"
+            base = 7 + i * 4
+            out[base:base + 4] = (obj.rect.centerx - px, obj.rect.centery - py, kind, active)
+        return out
+
+    def render_frame(self, out=None):
+        """
+        Render the level and downscale it to frame_size.
+
+        Args:
+            out (numpy.ndarray, optional): uint8 buffer of shape (height, width, 3).
+
+        Returns:
+            numpy.ndarray: The filled buffer.
+        """
+        width, height = self.frame_size
+        if out is None:
+            out = np.zeros((height, width, 3), np.uint8)
+        level = self.level
+        render_scene(self.canvas, [], None, level.player, level.objects,
+                     level.offset_x, level.terrain)
+        small = pygame.transform.scale(self.canvas, (width, height))
+        out[:] = pygame.surfarray.pixels3d(small).transpose(1, 0, 2)
+        return out
+
+
+@contextmanager
+def headless_sdl():
+    """
+    Make processes started inside the block use the dummy SDL drivers.
+
+    Spawned workers import this module, which opens a window; with the
+    dummy drivers that costs nothing and needs no display.
+    """
+    saved = {key: os.environ.get(key) for key in ("SDL_VIDEODRIVER", "SDL_AUDIODRIVER")}
+    os.environ["SDL_VIDEODRIVER"] = os.environ["SDL_AUDIODRIVER"] = "dummy"
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def _env_worker(index, conn, shm_names, num_envs, max_steps, frame_size):
+    """
+    Run one MangoEnv in a worker process for VectorMangoEnv.
+
+    Observations, rewards and done flags are written straight into the
+    shared buffers; only the command and a short ack go through the pipe.
+    """
+    buffers = [shared_memory.SharedMemory(name=name) for name in shm_names]
+    states = np.ndarray((num_envs, OBSERVATION_SIZE), np.float32, buffer=buffers[0].buf)
+    results = np.ndarray((num_envs, 2), np.float32, buffer=buffers[1].buf)
+    frames = None
+    if frame_size:
+        width, height = frame_size
+        frames = np.ndarray((num_envs, height, width, 3), np.uint8, buffer=buffers[2].buf)
+
+    env = MangoEnv(max_steps, frame_size)
+    try:
+        while True:
+            command, action = conn.recv()
+            if command == "close":
+                break
+            if command == "reset":
+                env.reset()
+                results[index] = 0
+            else:
+                _, reward, done, _ = env.step(action)
+                results[index] = (reward, done)
+                if done:
+                    env.reset()
+            env.observe(states[index])
+            if frames is not None:
+                env.render_frame(frames[index])
+            conn.send(None)
+    finally:
+        del states, results, frames
+        for shm in buffers:
+            shm.close()
+        conn.close()
+
+
+class VectorMangoEnv:
+    """
+    Runs several MangoEnv instances in worker processes.
+
+    Workers use the dummy SDL video driver and write observations into
+    shared memory, so a step only sends one small command per worker and
+    the returned arrays are views of the shared buffers. Finished episodes
+    are reset automatically; the observation returned with done=True is
+    already the first observation of the next episode.
+    """
+    def __init__(self, num_envs, max_steps=FPS * 60, frame_size=None):
+        """
+        Start the worker processes.
+
+        Args:
+            num_envs (int): Number of game instances.
+            max_steps (int): Steps before an episode is cut off.
+            frame_size (tuple, optional): (width, height) of per-env frames.
+        """
+        self.num_envs = num_envs
+        self.frame_size = frame_size
+        sizes = [num_envs * OBSERVATION_SIZE * 4, num_envs * 2 * 4]
+        if frame_size:
+            sizes.append(num_envs * frame_size[0] * frame_size[1] * 3)
+        self._buffers = [shared_memory.SharedMemory(create=True, size=size) for size in sizes]
+        self.states = np.ndarray((num_envs, OBSERVATION_SIZE), np.float32, buffer=self._buffers[0].buf)
+        self._results = np.ndarray((num_envs, 2), np.float32, buffer=self._buffers[1].buf)
+        self.frames = None
+        if frame_size:
+            width, height = frame_size
+            self.frames = np.ndarray((num_envs, height, width, 3), np.uint8, buffer=self._buffers[2].buf)
+
+        ctx = multiprocessing.get_context("spawn")
+        names = [shm.name for shm in self._buffers]
+        self._conns = []
+        self._processes = []
+        with headless_sdl():
+            for i in range(num_envs):
+                parent, child = ctx.Pipe()
+                process = ctx.Process(
+                    target=_env_worker,
+                    args=(i, child, names, num_envs, max_steps, frame_size),
+                    daemon=True,
+                )
+                process.start()
+                child.close()
+                self._conns.append(parent)
+                self._processes.append(process)
+
+    def _run(self, commands):
+        for conn, command in zip(self._conns, commands):
+            conn.send(command)
+        for conn in self._conns:
+            conn.recv()
+
+    def reset(self):
+        """
+        Reset every game.
+
+        Returns:
+            numpy.ndarray: Observations of shape (num_envs, OBSERVATION_SIZE).
+        """
+        self._run([("reset", None)] * self.num_envs)
+        return self.states
+
+    def step(self, actions):
+        """
+        Step every game with its own action.
+
+        Args:
+            actions (sequence): One ACTIONS index per game.
+
+        Returns:
+            tuple: (observations, rewards, dones) arrays over the games.
+        """
+        self._run([("step", int(action)) for action in actions])
+        return self.states, self._results[:, 0], self._results[:, 1].astype(bool)
+
+    def close(self):
+        """
+        Stop the workers and free the shared buffers.
+        """
+        for conn in self._conns:
+            try:
+                conn.send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+        self.states = self._results = self.frames = None
+        for shm in self._buffers:
+            shm.close()
+            shm.unlink()
+        self._buffers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# -------------------- Level Validator --------------------
+PLAYER_SPRITE_SIZE = 64  # 32x32 MaskDude frames after scale2x
+STATE_GRID = 24  # pixel size of the position buckets states are memoized in
+
+ValidationReport = namedtuple("ValidationReport",
+                              ["reachable", "unreachable", "requires_fire", "unproven", "states"])
+ValidationReport.__doc__ = """
+Result of validate_layout().
+
+reachable maps each collectable mango index to a per-frame list of ACTIONS
+indexes that reaches it without touching fire. unreachable lists mangoes
+that cannot be reached at all, and requires_fire the ones that can only be
+reached by running through a fire. unproven lists the mangoes among those
+two whose exact re-check hit max_states before trying every state, so a
+path may still exist. states is the number of distinct memoized states
+explored.
+"""
+
+
+def mask_bounds(masks):
+    """
+    Get the box around every set pixel of some masks.
+
+    Args:
+        masks (iterable): pygame.mask.Mask objects sharing one origin.
+
+    Returns:
+        tuple: (left, top, right, bottom), or (0, 0, 0, 0) if every mask is empty.
+    """
+    rects = [rect for mask in masks for rect in mask.get_bounding_rects()]
+    if not rects:
+        return 0, 0, 0, 0
+    box = rects[0].unionall(rects[1:])
+    return box.left, box.top, box.right, box.bottom
+
+
+class HeadlessPhysics:
+    """
+    Copy of the player physics that steps many states at once.
+
+    step() mirrors one frame of MangoEnv.step (Player.jump, Player.loop and
+    handle_move) on NumPy arrays, one element per state. Collisions use the
+    game's own masks: the player frame update_sprite() would pick, the
+    block mask and the mango masks, and a mango is solid in the frame it is
+    picked up, just like in handle_move. A box test against a summed-area
+    table finds the few states that are close to something, and only those
+    get the exact mask test. Fires are solid over their whole frame, so a
+    path that keeps clear of that box never touches a fire.
+
+    A batch of states is a tuple of arrays (x, y, x_vel, y_vel, jump_count,
+    fall_count, direction, animation, collected): x and y are the sprite's
+    top-left corner, direction indexes Player.DIRECTIONS, animation counts
+    ticks since the current animation started and collected is a bitmask
+    over the layout's mangoes.
+    """
+    def __init__(self, layout):
+        """
+        Collect the terrain, fires, mangoes and player frames of a layout.
+
+        Args:
+            layout (dict): Layout in the default_layout() format.
+
+        Raises:
+            ValueError: If the layout has more mangoes than the bitmask holds.
+        """
+        if len(layout["mangoes"]) > 63:
+            raise ValueError("HeadlessPhysics tracks at most 63 mangoes per layout")
+        size = self.block_size = layout["block_size"]
+        self.blocks = np.array([(x, y, x + size, y + size) for x, y in layout["blocks"]],
+                               np.float64).reshape(-1, 4)
+        self.block_mask = Block(0, 0, size).mask
+
+        # Fires count as solid over their whole frame (sheet frames are drawn
+        # at twice their size), whatever part of it is burning.
+        self.fires = np.array([(x, y, x + w * 2, y + h * 2) for x, y, w, h in layout["fires"]],
+                              np.float64).reshape(-1, 4)
+
+        self.mango_rects = np.array([(x, y, x + w, y + h) for x, y, w, h in layout["mangoes"]],
+                                    np.float64).reshape(-1, 4)
+        self.mango_masks = [Mango(*rect).mask for rect in layout["mangoes"]]
+        self.mangoes = np.array([np.add(mask_bounds([mask]), (x, y, x, y))
+                                 for mask, (x, y, _, _) in zip(self.mango_masks, self.mango_rects)],
+                                np.float64).reshape(-1, 4)
+        self.mango_bits = np.int64(1) << np.arange(len(self.mangoes), dtype=np.int64)
+
+        # Player frames, numbered so sprite_ids[row, tick] matches AnimationTable.
+        table = get_animation_table(Player.SPRITES, Player.STATES, Player.DIRECTIONS,
+                                    Player.ANIMATION_DELAY)
+        # Frames with identical masks share a number.
+        self.sprite_masks = []
+        numbers = {}
+        self.sprite_ids = np.zeros((len(table.masks), max(table.periods)), np.intp)
+        for row, masks in enumerate(table.masks):
+            for tick, mask in enumerate(masks):
+                pixels = (mask.get_size(), pygame.image.tobytes(mask.to_surface(), "RGB"))
+                if pixels not in numbers:
+                    numbers[pixels] = len(self.sprite_masks)
+                    self.sprite_masks.append(mask)
+                self.sprite_ids[row, tick] = numbers[pixels]
+        self.periods = np.array(table.periods, np.intp)
+        # The animation counter carries over between rows, so two counters
+        # pick the same frames forever only if they match modulo every row's
+        # repeat length (hit frames never show up headless).
+        self.cycle = 1
+        for state in (Player.IDLE, Player.RUN, Player.JUMP, Player.DOUBLE_JUMP, Player.FALL):
+            for direction in range(len(Player.DIRECTIONS)):
+                row = state * len(Player.DIRECTIONS) + direction
+                ids = self.sprite_ids[row, :self.periods[row]]
+                repeat = next(n for n in range(1, len(ids) + 1)
+                              if len(ids) % n == 0 and (ids == np.roll(ids, n)).all())
+                self.cycle = math.lcm(self.cycle, repeat)
+        self.sprite_bounds = np.array([mask_bounds([mask]) for mask in self.sprite_masks],
+                                      np.float64)
+        self.body = mask_bounds(self.sprite_masks)
+        self.sprite_size = self.sprite_masks[0].get_size()
+
+        player_x, player_y = layout["player"]
+        self.start = (np.array([player_x], np.float64), np.array([player_y], np.float64),
+                      np.zeros(1), np.zeros(1), *(np.zeros(1, np.int64) for _ in range(5)))
+        solids = np.concatenate([self.blocks, self.fires])
+        self.min_x = min(solids[:, 0].min(), player_x) - WIDTH // 2
+        self.max_x = solids[:, 2].max() + WIDTH // 2
+
+        # Most one jump can lift the sprite: Player.jump() and then the
+        # gentlest gravity Player.loop() applies, plus a pixel per frame for
+        # rounding. Nothing lifts the player except jumping.
+        self.jump_rise, y_vel, fall_count = 0, -Player.GRAVITY * 8, 0
+        while y_vel < 0:
+            self.jump_rise += 1 - y_vel
+            y_vel += min(1, fall_count / FPS * Player.GRAVITY)
+            fall_count += 1
+        # Below this (less whatever the state can still climb) there is
+        # nothing left to land on or collect.
+        self.floor = max(solids[:, 1].max(), self.mangoes[:, 3].max(initial=-np.inf))
+        # Above this no sprite can get, standing on the highest solid or at
+        # the start and jumping twice.
+        self.ceiling = min(solids[:, 1].min() - self.sprite_size[1], player_y) - self.jump_rise * 2
+
+        # The solids as one mask for the exact test, plus summed-area tables
+        # of the solid and mango boxes so "is this box near anything" is four
+        # lookups per state however many objects there are.
+        boxes = np.concatenate([solids, self.mangoes])
+        self.origin = boxes[:, :2].min(axis=0).astype(int)
+        self.extent = boxes[:, 2:].max(axis=0).astype(int) - self.origin
+        self.world = pygame.mask.Mask((int(self.extent[0]), int(self.extent[1])))
+        for left, top in self.blocks[:, :2].astype(int) - self.origin:
+            self.world.draw(self.block_mask, (left, top))
+        for left, top, right, bottom in self.fires.astype(int) - np.tile(self.origin, 2):
+            self.world.draw(pygame.mask.Mask((right - left, bottom - top), fill=True), (left, top))
+        self.solid_area = self.summed_area(solids)
+        self.mango_area = self.summed_area(self.mangoes)
+
+    def summed_area(self, boxes):
+        """
+        Build a summed-area table of the pixels covered by some boxes.
+
+        Args:
+            boxes (numpy.ndarray): (left, top, right, bottom) rows.
+
+        Returns:
+            numpy.ndarray: Table of shape (height + 1, width + 1) over the layout.
+        """
+        width, height = self.extent
+        covered = np.zeros((height, width), np.int32)
+        for left, top, right, bottom in boxes.astype(int) - np.tile(self.origin, 2):
+            covered[top:bottom, left:right] = 1
+        area = np.zeros((height + 1, width + 1), np.int32)
+        area[1:, 1:] = covered.cumsum(axis=0).cumsum(axis=1)
+        return area
+
+    def near(self, area, x, y, sprite, reach=0):
+        """
+        Test which player frames' boxes overlap the boxes in a summed-area table.
+
+        Args:
+            area (numpy.ndarray): Table from summed_area().
+            x (numpy.ndarray): Sprite x-positions.
+            y (numpy.ndarray): Sprite y-positions.
+            sprite (numpy.ndarray): Frame of each state, from sprites().
+            reach (int): Extra width added to each side of the frame's box.
+
+        Returns:
+            numpy.ndarray: Indexes of the states that are near.
+        """
+        bounds = self.sprite_bounds[sprite]
+        height, width = area.shape
+        left, top = self.origin
+        x0 = np.clip(x + bounds[:, 0] - reach - left, 0, width - 1).astype(np.intp)
+        x1 = np.clip(x + bounds[:, 2] + reach - left, 0, width - 1).astype(np.intp)
+        y0 = np.clip(y + bounds[:, 1] - top, 0, height - 1).astype(np.intp)
+        y1 = np.clip(y + bounds[:, 3] - top, 0, height - 1).astype(np.intp)
+        return np.flatnonzero(area[y1, x1] - area[y0, x1] - area[y1, x0] + area[y0, x0])
+
+    def overlaps(self, x, y, boxes, grow_x=0, grow_y=0):
+        """
+        Test the box around every player frame against every box.
+
+        Args:
+            x (numpy.ndarray): Sprite x-positions.
+            y (numpy.ndarray): Sprite y-positions.
+            boxes (numpy.ndarray): (left, top, right, bottom) rows.
+            grow_x (int): Extra width added to each side of the player box.
+            grow_y (int): Extra height added above and below the player box.
+
+        Returns:
+            numpy.ndarray: Boolean matrix of shape (states, boxes).
+        """
+        left, top, right, bottom = self.body
+        return ((boxes[:, 0] < (x + right + grow_x)[:, None])
+                & ((x + left - grow_x)[:, None] < boxes[:, 2])
+                & (boxes[:, 1] < (y + bottom + grow_y)[:, None])
+                & ((y + top - grow_y)[:, None] < boxes[:, 3]))
+
+    def touches(self, x, y, boxes):
+        """
+        Test which boxes each state could touch the way handle_move sees it:
+        the horizontal probes reach PLAYER_VEL * 2 to each side, and standing
+        on or bumping into an object counts as touching it.
+
+        Args:
+            x (numpy.ndarray): Sprite x-positions.
+            y (numpy.ndarray): Sprite y-positions.
+            boxes (numpy.ndarray): (left, top, right, bottom) rows.
+
+        Returns:
+            numpy.ndarray: Boolean matrix of shape (states, boxes).
+        """
+        return self.overlaps(x, y, boxes, PLAYER_VEL * 2, 1)
+
+    def sprites(self, x_vel, y_vel, jump_count, direction, animation):
+        """
+        Pick each state's player frame the way Player.update_sprite() does.
+
+        Args:
+            x_vel (numpy.ndarray): Horizontal velocities.
+            y_vel (numpy.ndarray): Vertical velocities.
+            jump_count (numpy.ndarray): Jumps used since landing.
+            direction (numpy.ndarray): Indexes into Player.DIRECTIONS.
+            animation (numpy.ndarray): Ticks since the animation started.
+
+        Returns:
+            numpy.ndarray: Indexes into sprite_masks.
+        """
+        rising = y_vel < 0
+        state = np.full(len(y_vel), Player.IDLE)
+        state[rising & (jump_count == 1)] = Player.JUMP
+        state[rising & (jump_count == 2)] = Player.DOUBLE_JUMP
+        state[~rising & (y_vel > Player.GRAVITY * 2)] = Player.FALL
+        state[~rising & (y_vel <= Player.GRAVITY * 2) & (x_vel != 0)] = Player.RUN
+        row = state * len(Player.DIRECTIONS) + direction
+        return self.sprite_ids[row, animation % self.periods[row]]
+
+    def blocked(self, x, y, sprite, among=None):
+        """
+        Test which player frames overlap the terrain or a fire.
+
+        Args:
+            x (numpy.ndarray): Sprite x-positions.
+            y (numpy.ndarray): Sprite y-positions.
+            sprite (numpy.ndarray): Frame of each state, from sprites().
+            among (numpy.ndarray, optional): Indexes of the only states that
+                can be blocked, from near(). Defaults to a near() lookup.
+
+        Returns:
+            numpy.ndarray: One bool per state.
+        """
+        left, top = self.origin
+        if among is None:
+            among = self.near(self.solid_area, x, y, sprite)
+        hit = np.zeros(len(x), bool)
+        for i in among:
+            offset = (int(x[i]) - left, int(y[i]) - top)
+            hit[i] = self.world.overlap(self.sprite_masks[sprite[i]], offset) is not None
+        return hit
+
+    def mango_hit(self, x, y, sprite, collected, among=None):
+        """
+        Find the first uncollected mango each player frame overlaps.
+
+        Args:
+            x (numpy.ndarray): Sprite x-positions.
+            y (numpy.ndarray): Sprite y-positions.
+            sprite (numpy.ndarray): Frame of each state, from sprites().
+            collected (numpy.ndarray): Collected-mango bitmask of each state.
+            among (numpy.ndarray, optional): Indexes of the only states that
+                can touch a mango, from near(). Defaults to a near() lookup.
+
+        Returns:
+            numpy.ndarray: Mango index per state, or -1.
+        """
+        first = np.full(len(x), -1, np.intp)
+        if len(self.mangoes) == 0:
+            return first
+        close = self.near(self.mango_area, x, y, sprite) if among is None else among
+        bounds = self.sprite_bounds[sprite[close]]
+        cx, cy = x[close, None], y[close, None]
+        boxes = self.mangoes
+        near = ((boxes[:, 0] < cx + bounds[:, 2, None]) & (cx + bounds[:, 0, None] < boxes[:, 2])
+                & (boxes[:, 1] < cy + bounds[:, 3, None]) & (cy + bounds[:, 1, None] < boxes[:, 3])
+                & ((collected[close, None] & self.mango_bits) == 0))
+        for i, j in zip(close[np.nonzero(near)[0]], np.nonzero(near)[1]):
+            if first[i] < 0:
+                offset = (int(x[i] - self.mango_rects[j, 0]), int(y[i] - self.mango_rects[j, 1]))
+                if self.mango_masks[j].overlap(self.sprite_masks[sprite[i]], offset) is not None:
+                    first[i] = j
+        return first
+
+    def reach(self, x, y):
+        """
+        Get which blocks handle_move would pass to the collision checks.
+
+        Args:
+            x (numpy.ndarray): Sprite x-positions.
+            y (numpy.ndarray): Sprite y-positions.
+
+        Returns:
+            numpy.ndarray: (states, blocks) bool matrix of blocks that
+                           TerrainGrid.query() returns around each sprite.
+        """
+        margin = PLAYER_VEL * 2
+        width, height = self.sprite_size
+        blocks = self.blocks
+        x, y = x[:, None], y[:, None]
+        return ((blocks[:, 0] < x + width + margin) & (x - margin < blocks[:, 2])
+                & (blocks[:, 1] < y + height + margin) & (y - margin < blocks[:, 3]))
+
+    def nearby(self, x, y):
+        """
+        Get the blocks handle_move checks for one state, in query order.
+
+        TerrainGrid.query() walks grid cells column by column, so a block is
+        returned from the first cell it shares with the queried area.
+
+        Args:
+            x (float): Sprite x-position.
+            y (float): Sprite y-position.
+
+        Returns:
+            numpy.ndarray: Block indexes.
+        """
+        near = np.flatnonzero(self.reach(np.array([x]), np.array([y]))[0])
+        margin = PLAYER_VEL * 2
+        size = self.block_size
+        blocks = self.blocks[near]
+        column = np.maximum(blocks[:, 0], x - margin) // size
+        row = np.maximum(blocks[:, 1], y - margin) // size
+        return near[np.lexsort((near, row, column))]
+
+    def land(self, x, y, dy, sprite, collected):
+        """
+        Replay handle_vertical_collision for one state.
+
+        Objects are checked in the order handle_move passes them (terrain,
+        mangoes, fires) and each overlap moves the player onto or under the
+        object before the next one is checked.
+
+        Args:
+            x (float): Sprite x-position.
+            y (float): Sprite y-position.
+            dy (float): Vertical velocity the collisions are resolved with.
+            sprite (int): Player frame, from sprites().
+            collected (int): Collected-mango bitmask.
+
+        Returns:
+            tuple: (y, landed, bumps, picked) where bumps counts head hits
+                   and picked is a bitmask of the mangoes touched.
+        """
+        mask = self.sprite_masks[sprite]
+        objects = [(self.blocks[j], self.block_mask, -1) for j in self.nearby(x, y)]
+        objects += [(rect, other, j) for j, (rect, other) in
+                    enumerate(zip(self.mango_rects, self.mango_masks)) if not collected >> j & 1]
+        objects += [(rect, None, -1) for rect in self.fires]
+        landed, bumps, picked = False, 0, 0
+        for rect, other, mango in objects:
+            if other is None:
+                left, top, right, bottom = self.sprite_bounds[sprite] + (x, y, x, y)
+                if not (rect[0] < right and left < rect[2] and rect[1] < bottom and top < rect[3]):
+                    continue
+            elif other.overlap(mask, (int(x - rect[0]), int(y - rect[1]))) is None:
+                continue
+            if dy > 0:
+                y = rect[1] - self.sprite_size[1]
+                landed = True
+            elif dy < 0:
+                y = rect[3]
+                bumps += 1
+            if mango >= 0:
+                picked |= 1 << mango
+        return y, landed, bumps, picked
+
+    def step(self, states, left, right, jump):
+        """
+        Advance every state by one frame.
+
+        Args:
+            states (tuple): Batch of states.
+            left (numpy.ndarray): Left key held, per state.
+            right (numpy.ndarray): Right key held, per state.
+            jump (numpy.ndarray): Jump pressed this frame, per state.
+
+        Returns:
+            tuple: The next batch of states.
+        """
+        x, y, x_vel, y_vel, jump_count, fall_count, direction, animation, collected = states
+        animation = animation + 1  # ANIMATION_CLOCK.advance()
+
+        # Player.jump
+        jumps = jump & (jump_count < 2)
+        y_vel = np.where(jumps, -Player.GRAVITY * 8, y_vel)
+        jump_count = jump_count + jumps
+        fall_count = np.where(jumps & (jump_count == 1), 0, fall_count)
+        animation = np.where(jumps, 0, animation)
+
+        # Player.loop (pygame.Rect rounds half away from zero)
+        y_vel = y_vel + np.minimum(1, fall_count / FPS * Player.GRAVITY)
+        x = x + x_vel
+        y = y + y_vel
+        y = np.trunc(y + np.copysign(0.5, y))
+        fall_count = np.minimum(fall_count + 1, FPS)  # gravity stops growing after FPS frames
+        sprite = self.sprites(x_vel, y_vel, jump_count, direction, animation)
+
+        # handle_move: each probe stops at terrain before it sees a mango,
+        # and mangoes are only removed once the whole frame is resolved
+        probe = PLAYER_VEL * 2
+        near_solid = self.near(self.solid_area, x, y, sprite, probe)
+        near_mango = self.near(self.mango_area, x, y, sprite, probe)
+        stops, picks = [], []
+        for dx in (-probe, probe):
+            solid = self.blocked(x + dx, y, sprite, near_solid)
+            mango = np.where(solid, -1, self.mango_hit(x + dx, y, sprite, collected, near_mango))
+            stops.append(solid | (mango >= 0))
+            picks.append(mango)
+        x_vel = np.zeros_like(x)
+        for go, vel, facing in ((left & ~stops[0], -PLAYER_VEL, 0),
+                                (right & ~stops[1], PLAYER_VEL, 1)):
+            x_vel[go] = vel
+            animation = np.where(go & (direction != facing), 0, animation)
+            direction = np.where(go, facing, direction)
+
+        new_collected = collected.copy()
+        for mango in picks:
+            new_collected[mango >= 0] |= self.mango_bits[mango[mango >= 0]]
+
+        # handle_vertical_collision. A state whose nearby blocks all share the
+        # edge it hits, and that meets no mango or fire before or after the
+        # snap, is moved once; anything else is replayed by land().
+        touching = np.flatnonzero(self.blocked(x, y, sprite, near_solid))
+        mangoes = self.mango_hit(x, y, sprite, collected, near_mango) >= 0
+        fires = np.zeros_like(mangoes)
+        if len(self.fires):
+            fires = self.overlaps(x, y, self.fires, 0, 0).any(axis=1)
+        dy = y_vel[touching, None]
+        near = self.reach(x[touching], y[touching])
+        edge = np.where(dy > 0, self.blocks[:, 1], self.blocks[:, 3])
+        low = np.where(near, edge, np.inf).min(axis=1)
+        high = np.where(near, edge, -np.inf).max(axis=1)
+        snapped = np.where(dy[:, 0] > 0, low - self.sprite_size[1], low)
+        simple = (low == high) & (dy[:, 0] != 0)
+        simple[simple] = self.mango_hit(x[touching[simple]], snapped[simple],
+                                        sprite[touching[simple]], collected[touching[simple]]) < 0
+        if len(self.fires):
+            simple[simple] = ~self.overlaps(x[touching[simple]], snapped[simple],
+                                            self.fires, 0, 0).any(axis=1)
+        simple &= ~mangoes[touching] & ~fires[touching]
+        falling = touching[simple & (dy[:, 0] > 0)]
+        rising = touching[simple & (dy[:, 0] < 0)]
+        y[falling] = snapped[simple & (dy[:, 0] > 0)]
+        y_vel[falling] = jump_count[falling] = fall_count[falling] = 0
+        y[rising] = snapped[simple & (dy[:, 0] < 0)]
+        y_vel[rising] = -y_vel[rising]
+
+        others = np.union1d(touching[~simple], np.flatnonzero(mangoes | fires))
+        for i in others:
+            y[i], landed, bumps, picked = self.land(x[i], y[i], y_vel[i], sprite[i],
+                                                    int(collected[i]))
+            if landed:
+                y_vel[i] = jump_count[i] = fall_count[i] = 0
+            if bumps % 2:
+                y_vel[i] = -y_vel[i]
+            new_collected[i] |= picked
+        return x, y, x_vel, y_vel, jump_count, fall_count, direction, animation, new_collected
+
+    def keys(self, states):
+        """
+        Bucket states for memoization.
+
+        States closer than STATE_GRID pixels with the same horizontal speed,
+        jump count and similar vertical speed usually behave alike, so only
+        one of them is expanded. The other fields still change where a state
+        can go, so a mango missed with these keys is re-checked with
+        exact_keys().
+
+        Args:
+            states (tuple): Batch of states.
+
+        Returns:
+            numpy.ndarray: One int64 key per state.
+        """
+        x, y, x_vel, y_vel, jump_count = states[:5]
+        column = ((x - self.min_x) // STATE_GRID).astype(np.int64)
+        row = ((y + HEIGHT) // STATE_GRID).astype(np.int64)
+        speed = np.sign(x_vel).astype(np.int64) + 1
+        fall = np.clip(np.round(y_vel / 3), -32, 31).astype(np.int64) + 32
+        return (((column * 4096 + row) * 4 + speed) * 64 + fall) * 4 + jump_count.astype(np.int64)
+
+    def exact_keys(self, states):
+        """
+        Key states on every field step() reads, so equal keys behave the same.
+
+        Args:
+            states (tuple): Batch of states.
+
+        Returns:
+            numpy.ndarray: One bytes-like key per state.
+        """
+        x, y, x_vel, y_vel, jump_count, fall_count, direction, animation, collected = states
+        fields = np.stack([(x + 0.0).view(np.int64), (y + 0.0).view(np.int64),
+                           (x_vel + 0.0).view(np.int64), (y_vel + 0.0).view(np.int64),
+                           jump_count, fall_count, direction, animation % self.cycle, collected],
+                          axis=1).astype(np.int64)
+        return np.ascontiguousarray(fields).view(np.dtype((np.void, fields.shape[1] * 8)))[:, 0]
+
+    def out_of_bounds(self, states):
+        """
+        Find states that can no longer land anywhere or reach a mango.
+
+        Args:
+            states (tuple): Batch of states.
+
+        Returns:
+            numpy.ndarray: One bool per state.
+        """
+        x, y, _, y_vel, jump_count = states[:5]
+        climb = (2 - jump_count + (y_vel < 0)) * self.jump_rise
+        return (x < self.min_x) | (x > self.max_x) | (y - climb > self.floor)
+
+
+def search_layout(layout, targets=None, avoid_fire=True, frames_per_input=6, max_seconds=30):
+    """
+    Breadth-first search of the headless state space for mango pickups.
+
+    The whole frontier is expanded at once: every state is paired with
+    every action and simulated for frames_per_input frames (a jump is
+    pressed on the first frame only). Visited states are memoized by
+    HeadlessPhysics.keys(), so the first path found to a mango is the
+    shortest in search steps among the states kept, but a mango missed here
+    may still be reachable through a state that was merged away.
+
+    Args:
+        layout (dict): Layout in the default_layout() format.
+        targets (iterable, optional): Mango indexes to look for. Defaults to all.
+        avoid_fire (bool): If True, states touching a fire are dead ends.
+        frames_per_input (int): Frames each chosen action is held for.
+        max_seconds (float): Longest play time searched.
+
+    Returns:
+        tuple: (paths, states) where paths maps mango index to per-frame
+               ACTIONS indexes and states is the number of states explored.
+    """
+    physics = HeadlessPhysics(layout)
+    targets = set(range(len(physics.mangoes)) if targets is None else targets)
+    targets = {i for i in targets if physics.mangoes[i, 3] >= physics.ceiling}
+    table = np.array(ACTIONS, bool)
+    action_count = len(ACTIONS)
+
+    frontier = physics.start
+    visited = physics.keys(frontier)
+    history = []  # per search step: (parent index, action) of each new state
+    found = {}
+    for _ in range(int(max_seconds * FPS) // frames_per_input):
+        if len(frontier[0]) == 0 or targets <= found.keys():
+            break
+        count = len(frontier[0])
+        parent = np.repeat(np.arange(count), action_count)
+        action = np.tile(np.arange(action_count), count)
+        left, right, jump = table[action].T
+        states = tuple(np.repeat(values, action_count) for values in frontier)
+        alive = np.ones(len(parent), bool)
+        for frame in range(frames_per_input):
+            states = physics.step(states, left, right, jump & (frame == 0))
+            alive &= ~physics.out_of_bounds(states)
+            if avoid_fire and len(physics.fires):
+                alive &= ~physics.touches(states[0], states[1], physics.fires).any(axis=1)
+
+        touched = (states[-1][:, None] & physics.mango_bits) != 0
+        keys = physics.keys(states)
+        keys, first = np.unique(np.where(alive, keys, -1), return_index=True)
+        new = (keys >= 0) & ~np.isin(keys, visited)
+        keep = first[new]
+        visited = np.concatenate([visited, keys[new]])
+        history.append((parent[keep], action[keep]))
+        frontier = tuple(values[keep] for values in states)
+
+        depth = len(history) - 1
+        for index in targets - found.keys():
+            hits = np.flatnonzero(touched[keep, index])
+            if len(hits):
+                found[index] = (depth, hits[0])
+
+    paths = {}
+    for index, (depth, position) in found.items():
+        steps = []
+        for parents, actions in reversed(history[:depth + 1]):
+            steps.append(int(actions[position]))
+            position = parents[position]
+        paths[index] = held_inputs(reversed(steps), frames_per_input)
+    return paths, len(visited)
+
+
+def held_inputs(steps, frames_per_input):
+    """
+    Expand search steps into per-frame inputs.
+
+    Args:
+        steps (iterable): ACTIONS indexes, one per search step.
+        frames_per_input (int): Frames each action is held for.
+
+    Returns:
+        list: ACTIONS indexes, one per frame, with a jump pressed on the
+              first frame of its step only.
+    """
+    release = [ACTIONS.index((left, right, False)) for left, right, _ in ACTIONS]
+    inputs = []
+    for action in steps:
+        inputs.append(action)
+        inputs.extend([release[action]] * (frames_per_input - 1))
+    return inputs
+
+
+def search_mango(layout, index, avoid_fire=True, frames_per_input=6, max_seconds=30,
+                 max_states=200_000, batch=256):
+    """
+    Exact best-first search of the headless state space for one mango.
+
+    States are memoized by HeadlessPhysics.exact_keys(), so no state is
+    dropped because a similar one was seen, and the batch of states expected
+    to be closest to the mango (frames played plus twice the frames a
+    straight run would take) is expanded next. The path found is not
+    necessarily the shortest, and if the search runs out of states to try
+    before max_states, the mango cannot be collected within max_seconds
+    with these frames_per_input.
+
+    Args:
+        layout (dict): Layout in the default_layout() format.
+        index (int): Mango index to look for.
+        avoid_fire (bool): If True, states touching a fire are dead ends.
+        frames_per_input (int): Frames each chosen action is held for.
+        max_seconds (float): Longest play time searched.
+        max_states (int): States explored before giving up.
+        batch (int): States expanded together.
+
+    Returns:
+        tuple: (inputs, states, exhausted) where inputs is the per-frame
+               ACTIONS indexes reaching the mango or None, states the number
+               of states explored and exhausted whether every state was tried.
+    """
+    physics = HeadlessPhysics(layout)
+    if physics.mangoes[index, 3] < physics.ceiling:
+        return None, 0, True
+    table = np.array(ACTIONS, bool)
+    action_count = len(ACTIONS)
+    left, top, right, bottom = physics.body
+    target = (physics.mangoes[index, :2] + physics.mangoes[index, 2:]) / 2 - ((left + right) / 2,
+                                                                             (top + bottom) / 2)
+    limit = int(max_seconds * FPS)
+
+    # Explored states, with the search step that first produced each one.
+    capacity = max_states + batch * action_count
+    nodes = tuple(np.zeros(capacity, values.dtype) for values in physics.start)
+    parents = np.full(capacity, -1, np.intp)
+    actions = np.full(capacity, -1, np.intp)
+    frames = np.zeros(capacity, np.int64)
+    for values, start in zip(nodes, physics.start):
+        values[0] = start[0]
+    count = 1
+    visited = set(physics.exact_keys(physics.start).tolist())
+    waiting = [(0.0, 0)]
+    found = None
+    while waiting and count < max_states:
+        chosen = np.array([heapq.heappop(waiting)[1] for _ in range(min(batch, len(waiting)))])
+        parent = np.repeat(chosen, action_count)
+        action = np.tile(np.arange(action_count), len(chosen))
+        press_left, press_right, jump = table[action].T
+        states = tuple(values[parent] for values in nodes)
+        alive = np.ones(len(parent), bool)
+        for frame in range(frames_per_input):
+            states = physics.step(states, press_left, press_right, jump & (frame == 0))
+            alive &= ~physics.out_of_bounds(states)
+            if avoid_fire and len(physics.fires):
+                alive &= ~physics.touches(states[0], states[1], physics.fires).any(axis=1)
+
+        keep = []
+        for position, key in enumerate(physics.exact_keys(states).tolist()):
+            if alive[position] and key not in visited:
+                visited.add(key)
+                keep.append(position)
+        keep = np.array(keep, np.intp)
+        new = np.arange(count, count + len(keep))
+        for values, state in zip(nodes, states):
+            values[new] = state[keep]
+        parents[new] = parent[keep]
+        actions[new] = action[keep]
+        frames[new] = frames[parent[keep]] + frames_per_input
+        count += len(keep)
+
+        hits = new[(nodes[-1][new] >> index) & 1 == 1]
+        if len(hits):
+            found = hits[0]
+            break
+        distance = np.hypot(nodes[0][new] - target[0], nodes[1][new] - target[1]) / PLAYER_VEL
+        for node, priority in zip(new.tolist(), (frames[new] + distance * 2).tolist()):
+            if frames[node] < limit:
+                heapq.heappush(waiting, (priority, node))
+
+    if found is None:
+        return None, count, not waiting
+    steps = []
+    while parents[found] >= 0:
+        steps.append(int(actions[found]))
+        found = parents[found]
+    return held_inputs(reversed(steps), frames_per_input), count, True
+
+
+
+
+def validate_layout(layout, frames_per_input=6, max_seconds=30, max_states=200_000, workers=1):
+    """
+    Check that every mango in a layout can be collected safely.
+
+    Args:
+        layout (dict): Layout in the default_layout() format.
+        frames_per_input (int): Frames each chosen action is held for.
+        max_seconds (float): Longest play time searched.
+        max_states (int): States each exact re-check explores before giving up.
+        workers (int): Worker processes the exact re-checks are split across.
+
+    Returns:
+        ValidationReport: Reachability of every mango.
+    """
+    return validate_campaign([layout], workers, frames_per_input, max_seconds, max_states)[0]
 
-    if keys[pygame.K_LEFT] and not collide_left:
-        player.move_left(PLAYER_VEL)
-    if keys[pygame.K_RIGHT] and not collide_right:
-        player.move_right(PLAYER_VEL)
 
-    vertical_collide = handle_vertical_collision(player, objects, player.y_vel)
-    to_check = [collide_left, collide_right, *vertical_collide]
-    for obj in to_check:
-        if obj:
-            if obj.name == "fire":
-                player.make_hit()
-            elif obj.name == "mango":
-                objects.remove(obj)
-                player.score += 1
-                print(f"Mango collected! Score: {player.score}")
+def validate_campaign(layouts, workers=None, frames_per_input=6, max_seconds=30,
+                      max_states=200_000):
+    """
+    Validate many layouts in parallel.
+
+    Every layout first gets a fast search_layout() pass, and each mango it
+    misses is then re-checked with its own search_mango() job, so a single
+    layout's slow re-checks are spread over the workers too.
+
+    Args:
+        layouts (list): Layouts in the default_layout() format.
+        workers (int, optional): Worker processes. Defaults to the CPU count.
+        frames_per_input (int): Frames each chosen action is held for.
+        max_seconds (float): Longest play time searched.
+        max_states (int): States each exact re-check explores before giving up.
+
+    Returns:
+        list: One ValidationReport per layout, in order.
+    """
+    workers = min(workers or os.cpu_count() or 1, sum(len(layout["mangoes"]) for layout in layouts))
+    if workers <= 1:
+        return _validate(layouts, map, frames_per_input, max_seconds, max_states)
+    # Spawned workers start on the first submit and copy the environment
+    # then, so the pool is used entirely inside headless_sdl().
+    with headless_sdl(), ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return _validate(layouts, pool.map, frames_per_input, max_seconds, max_states)
+
+
+def _validate(layouts, run, frames_per_input, max_seconds, max_states):
+    """
+    Run the searches behind validate_campaign() through a map function.
+
+    Args:
+        layouts (list): Layouts in the default_layout() format.
+        run (callable): map() or Executor.map.
+        frames_per_input (int): Frames each chosen action is held for.
+        max_seconds (float): Longest play time searched.
+        max_states (int): States each exact re-check explores before giving up.
+
+    Returns:
+        list: One ValidationReport per layout, in order.
+    """
+    coarse = functools.partial(search_layout, frames_per_input=frames_per_input,
+                               max_seconds=max_seconds)
+    exact = functools.partial(search_mango, frames_per_input=frames_per_input,
+                              max_seconds=max_seconds, max_states=max_states)
+    results = list(run(coarse, layouts))
+    paths = [found for found, _ in results]
+    states = [count for _, count in results]
+    missing = [(i, index) for i, layout in enumerate(layouts)
+               for index in range(len(layout["mangoes"])) if index not in paths[i]]
+
+    # Mangoes the coarse search only reaches through fire.
+    risky = [set() for _ in layouts]
+    burning = sorted({i for i, _ in missing if layouts[i]["fires"]})
+    targets = [[index for j, index in missing if j == i] for i in burning]
+    for i, (found, count) in zip(burning, run(functools.partial(coarse, avoid_fire=False),
+                                              [layouts[i] for i in burning], targets)):
+        risky[i].update(found)
+        states[i] += count
+
+    # Exact re-checks of every miss, without and then with fire.
+    unproven = [set() for _ in layouts]
+    checks = run(exact, [layouts[i] for i, _ in missing], [index for _, index in missing])
+    for (i, index), (inputs, count, exhausted) in zip(missing, checks):
+        states[i] += count
+        if inputs is not None:
+            paths[i][index] = inputs
+        elif not exhausted:
+            unproven[i].add(index)
+    missing = [(i, index) for i, index in missing if index not in paths[i]]
+    burning = [(i, index) for i, index in missing if layouts[i]["fires"] and index not in risky[i]]
+    checks = run(functools.partial(exact, avoid_fire=False),
+                 [layouts[i] for i, _ in burning], [index for _, index in burning])
+    for (i, index), (inputs, count, exhausted) in zip(burning, checks):
+        states[i] += count
+        if inputs is not None:
+            risky[i].add(index)
+        elif not exhausted:
+            unproven[i].add(index)
+
+    reports = []
+    for i in range(len(layouts)):
+        blocked = [index for j, index in missing if j == i]
+        reports.append(ValidationReport(
+            paths[i], [index for index in blocked if index not in risky[i]],
+            [index for index in blocked if index in risky[i]],
+            sorted(unproven[i]), states[i]))
+    return reports
+
+
+# -------------------- Navigation Graph --------------------
+NAV_MOVES = ("walk", "jump", "double_jump")
+DOUBLE_JUMP_DELAYS = (10, 20, 30)  # frames between the two jumps of a double jump
+
+NavSurface = namedtuple("NavSurface", ["left", "right", "y"])
+NavSurface.__doc__ = """
+Standable top edge of terrain from x=left to x=right (exclusive) at height y,
+with room above it for the player.
+"""
+
+NavEdge = namedtuple("NavEdge", ["source", "target", "kind", "takeoff", "landing", "frames",
+                                 "steer", "second_jump"])
+NavEdge.__doc__ = """
+Move between two surfaces. kind is one of NAV_MOVES (walk covers walking
+off a ledge), takeoff and landing are sprite x-positions on the source and
+target surface, and frames is the time spent in the air. To perform it,
+leave the source at takeoff (jumping on frame 0 unless walking), hold the
+direction of landing from frame steer until there, and for a double jump
+jump again on frame second_jump (None otherwise).
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def nav_arcs():
+    """
+    Simulate the vertical movement of every move the navigation graph uses.
+
+    The arcs follow Player.jump and Player.loop exactly (GRAVITY, the jump
+    velocity and pygame.Rect rounding, which is half-up for the positive
+    heights levels use) without collisions.
+
+    Returns:
+        tuple: (kind, second_jump, offsets) triples, where offsets[t] is the
+        sprite's y offset from its starting height after t + 1 frames.
+    """
+    def simulate(jumps):
+        y, y_vel, fall_count, offsets = 0, 0, 0, []
+        while y < HEIGHT * 2:
+            if len(offsets) in jumps:
+                y_vel = -Player.GRAVITY * 8
+                if len(offsets) == 0:
+                    fall_count = 0
+            y_vel += min(1, fall_count / FPS * Player.GRAVITY)
+            y = math.floor(y + y_vel + 0.5)
+            fall_count += 1
+            offsets.append(y)
+        return tuple(offsets)
+
+    arcs = [("walk", None, simulate(())), ("jump", None, simulate((0,)))]
+    arcs.extend(("double_jump", delay, simulate((0, delay))) for delay in DOUBLE_JUMP_DELAYS)
+    return tuple(arcs)
+
+
+def nav_land_time(offsets, dy):
+    """
+    Get when an arc comes down onto a surface dy pixels below the start.
+
+    Args:
+        offsets (tuple): Arc from nav_arcs().
+        dy (int): Target height minus start height (negative is higher).
+
+    Returns:
+        int: Frames until landing, or None if the arc never gets above it.
+    """
+    apex = offsets.index(min(offsets))
+    if offsets[apex] > dy:
+        return None
+    for t in range(apex, len(offsets)):
+        if offsets[t] >= dy:
+            return t + 1
+    return None
+
+
+class NavGraph:
+    """
+    Platform navigation graph for bots.
+
+    Nodes are standable surfaces found in a TerrainGrid; edges are walk-off,
+    jump and double-jump moves checked against the real Player physics and
+    the terrain in between. The graph listens to its TerrainGrid, so when
+    Block.destroy, Block.move or Block.resize change the terrain only the
+    surfaces and edges near the change are rebuilt: surfaces are indexed by
+    terrain column, a surface is only connected to the ones a flight can
+    span, and the areas edge checks looked at are bucketed by terrain chunk.
+    find_path() and path_to_mango() run A* over the surfaces.
+    """
+    def __init__(self, terrain):
+        """
+        Build the graph for a terrain grid and start following its changes.
+
+        Args:
+            terrain (TerrainGrid): Level terrain.
+        """
+        self.terrain = terrain
+        self.surfaces = {}
+        self.columns = {}  # terrain column -> ids of the surfaces over it
+        self.edges = {}  # source id -> {target id: NavEdge}
+        self.incoming = {}  # target id -> source ids with an edge to it
+        self.checked = {}  # (source id, target id) -> area the check looked at
+        self.checked_cells = {}  # terrain chunk -> pairs whose area touches it
+        self.checked_by = {}  # surface id -> pairs it is part of
+        self.next_id = 0
+        arcs = [offsets for _, _, offsets in nav_arcs()]
+        self.max_rise = -min(min(offsets) for offsets in arcs)
+        self.max_fall = max(max(offsets) for offsets in arcs)
+        self.reach = max(len(offsets) for offsets in arcs) * PLAYER_VEL
+
+        # The sprite boxes the checks use, from the frames the player shows
+        # while moving (body, for clearance) and while standing (hitbox).
+        table = get_animation_table(Player.SPRITES, Player.STATES, Player.DIRECTIONS,
+                                    Player.ANIMATION_DELAY)
+        directions = len(Player.DIRECTIONS)
+        rows = range(Player.IDLE * directions, (Player.FALL + 1) * directions)
+        self.body = mask_bounds(mask for row in rows for mask in table.masks[row])
+        self.hitbox = mask_bounds(mask for row in rows[:directions] for mask in table.masks[row])
+        blocks = {block: None for cell in terrain.cells.values() for block in cell}
+        if blocks:
+            rects = [block.rect for block in blocks]
+            self._replace([], self._find_surfaces(rects[0].unionall(rects[1:])))
+        terrain.listeners.append(self.update)
+
+    def close(self):
+        """
+        Stop following terrain changes.
+        """
+        self.terrain.listeners.remove(self.update)
+
+    def standing_range(self, surface):
+        """
+        Get the sprite x-positions where the player stands safely on a surface.
+
+        The middle of the hitbox has to be over the surface; standing on the
+        very edge depends on the animated sprite mask.
+
+        Args:
+            surface (NavSurface): Surface to stand on.
+
+        Returns:
+            tuple: Lowest and highest sprite x, inclusive.
+        """
+        middle = (self.hitbox[0] + self.hitbox[2]) // 2
+        return surface.left - middle, surface.right - middle - 1
+
+    def surfaces_in(self, area):
+        """
+        Find the surfaces overlapping an area, using the column index.
+
+        Args:
+            area (pygame.Rect): Area to search; a surface on its top or
+                bottom edge counts.
+
+        Returns:
+            list: Surface ids, in creation order.
+        """
+        size = self.terrain.cell_size
+        found = set()
+        for column in range(area.left // size, (area.right - 1) // size + 1):
+            found.update(self.columns.get(column, ()))
+        return sorted(sid for sid in found
+                      if area.top <= self.surfaces[sid].y <= area.bottom
+                      and self.surfaces[sid].left < area.right
+                      and self.surfaces[sid].right > area.left)
+
+    def _find_surfaces(self, area):
+        """
+        Find the standable surfaces on top of the blocks in an area.
+
+        Args:
+            area (pygame.Rect): Area the block tops must lie in.
+
+        Returns:
+            list: NavSurface tuples, contiguous segments merged.
+        """
+        hh = self.hitbox[3] - self.hitbox[1]
+        rows = {}
+        for block in self.terrain.query(area):
+            rect = block.rect
+            if not area.top <= rect.top <= area.bottom:
+                continue
+            segments = [(rect.left, rect.right)]
+            for other in self.terrain.query(pygame.Rect(rect.left, rect.top - hh, rect.width, hh)):
+                cut = []
+                for left, right in segments:
+                    if other.rect.right <= left or other.rect.left >= right:
+                        cut.append((left, right))
+                        continue
+                    if left < other.rect.left:
+                        cut.append((left, other.rect.left))
+                    if other.rect.right < right:
+                        cut.append((other.rect.right, right))
+                segments = cut
+            if segments:
+                rows.setdefault(rect.top, []).extend(segments)
+
+        surfaces = []
+        for y, segments in rows.items():
+            segments.sort()
+            left, right = segments[0]
+            for start, end in segments[1:]:
+                if start <= right:
+                    right = max(right, end)
+                else:
+                    surfaces.append(NavSurface(left, right, y))
+                    left, right = start, end
+            surfaces.append(NavSurface(left, right, y))
+        return surfaces
+
+    def _replace(self, old_ids, new_surfaces):
+        """
+        Swap surfaces and rebuild the edges to and from the new ones.
+        """
+        kept = {self.surfaces[sid]: sid for sid in old_ids}
+        added = []
+        size = self.terrain.cell_size
+        for surface in new_surfaces:
+            if surface in kept:
+                del kept[surface]  # unchanged, keeps its id and edges
+                continue
+            sid = self.next_id
+            self.next_id += 1
+            self.surfaces[sid] = surface
+            self.edges[sid] = {}
+            self.incoming[sid] = set()
+            self.checked_by[sid] = set()
+            for column in range(surface.left // size, (surface.right - 1) // size + 1):
+                self.columns.setdefault(column, set()).add(sid)
+            added.append(sid)
+        for sid in kept.values():
+            for pair in list(self.checked_by[sid]):
+                self._forget(*pair)
+            for source in self.incoming.pop(sid):
+                del self.edges[source][sid]
+            for target in self.edges.pop(sid):
+                self.incoming[target].discard(sid)
+            del self.checked_by[sid]
+            surface = self.surfaces.pop(sid)
+            for column in range(surface.left // size, (surface.right - 1) // size + 1):
+                self.columns[column].discard(sid)
+                if not self.columns[column]:
+                    del self.columns[column]
+        for sid in added:
+            # Only surfaces a flight can span, up or down, get a check.
+            surface = self.surfaces[sid]
+            area = pygame.Rect(surface.left - self.reach, surface.y - self.max_fall,
+                               surface.right - surface.left + self.reach * 2, self.max_fall * 2)
+            for other in self.surfaces_in(area):
+                if other != sid:
+                    self._connect(sid, other)
+                    if other not in added:
+                        self._connect(other, sid)
+
+    def _forget(self, source, target):
+        """
+        Drop the edge between two surfaces and the area its check looked at.
+        """
+        if self.edges[source].pop(target, None) is not None:
+            self.incoming[target].discard(source)
+        area = self.checked.pop((source, target), None)
+        if area is None:
+            return
+        self.checked_by[source].discard((source, target))
+        self.checked_by[target].discard((source, target))
+        for key in self.terrain._keys(area, self.terrain.chunk_size):
+            self.checked_cells[key].discard((source, target))
+            if not self.checked_cells[key]:
+                del self.checked_cells[key]
+
+    def _remember(self, source, target, edge, area):
+        """
+        Store the edge between two surfaces (None if there is none) and the
+        area its check looked at.
+        """
+        if edge is not None:
+            self.edges[source][target] = edge
+            self.incoming[target].add(source)
+        if area is None:
+            return
+        self.checked[(source, target)] = area
+        self.checked_by[source].add((source, target))
+        self.checked_by[target].add((source, target))
+        for key in self.terrain._keys(area, self.terrain.chunk_size):
+            self.checked_cells.setdefault(key, set()).add((source, target))
+
+    def _connect(self, source, target):
+        """
+        Work out the cheapest move from one surface to another, if any.
+        """
+        self._forget(source, target)
+        a, b = self.surfaces[source], self.surfaces[target]
+        a_lo, a_hi = self.standing_range(a)
+        b_lo, b_hi = self.standing_range(b)
+        dy = b.y - a.y
+        gap = max(0, b_lo - a_hi, a_lo - b_hi)
+        body_left, _, body_right, _ = self.body
+        beside_a = (a.left - body_right, a.right - body_left)  # body just clear of the surface
+        beside_b = (b.left - body_right, b.right - body_left)
+        if b_hi - b_lo > PLAYER_VEL * 2:
+            # Aim a step inside the target, since steering moves PLAYER_VEL at a time.
+            b_lo, b_hi = b_lo + PLAYER_VEL, b_hi - PLAYER_VEL
+
+        if dy == 0 and gap == 0:
+            # Level with a crack narrower than the hitbox: just walk across.
+            crossing = min(max(b_lo, a_lo), a_hi)
+            self._remember(source, target,
+                           NavEdge(source, target, "walk", crossing, crossing, 0, 0, None), None)
+            return
+
+        checked = None
+        for kind, second_jump, offsets in nav_arcs():
+            frames = nav_land_time(offsets, dy)
+            if frames is None or (frames - 1) * PLAYER_VEL < gap or (kind == "walk" and dy <= 0):
+                continue
+            # Take off from the nearest point or from just beside the
+            # target's block so the jump does not hit it from below, and
+            # land straight ahead or just clear of the source's block.
+            takeoffs = {min(max(x, a_lo), a_hi) for x in (b_lo, b_hi, *beside_b)}
+            moves = {(takeoff, min(max(x, b_lo), b_hi))
+                     for takeoff in takeoffs for x in (takeoff, *beside_a)}
+            for takeoff, landing in sorted(moves, key=lambda move: abs(move[1] - move[0])):
+                steer_frames = -(-abs(landing - takeoff) // PLAYER_VEL)
+                if steer_frames > frames - 1:
+                    continue
+                # Steer straight away, or rise first and steer at the end.
+                for steer in dict.fromkeys((0, frames - 1 - steer_frames)):
+                    clear, swept = self._flight_clear(a.y, b.y, offsets, frames, takeoff,
+                                                      landing, steer)
+                    checked = swept if checked is None else checked.union(swept)
+                    if clear:
+                        self._remember(source, target,
+                                       NavEdge(source, target, kind, takeoff, landing, frames,
+                                               steer, second_jump), checked)
+                        return
+        self._remember(source, target, None, checked)
+
+    def _flight_clear(self, start_y, end_y, offsets, frames, takeoff, landing, steer):
+        """
+        Fly the player's body along an arc and test it against the terrain.
+
+        Args:
+            start_y (int): Height of the source surface.
+            end_y (int): Height of the target surface.
+            offsets (tuple): Arc from nav_arcs().
+            frames (int): Frames until landing.
+            takeoff (int): Sprite x at takeoff.
+            landing (int): Sprite x at landing.
+            steer (int): Frame the direction key is pressed on; the player
+                starts moving on the next frame, like handle_move.
+
+        Returns:
+            tuple: (clear, swept) where swept is the area the body passed through.
+        """
+        left, body_top, right, bottom = self.body
+        hx, hy, hw, hh = left, body_top, right - left, bottom - body_top
+        top = start_y - PLAYER_SPRITE_SIZE
+        distance = landing - takeoff
+        probe = PLAYER_VEL * 2 if distance > 0 else -PLAYER_VEL * 2
+        swept = pygame.Rect(takeoff + hx, top + hy, hw, hh)
+        if self.terrain.query(swept):
+            return False, swept  # no room to stand at the takeoff point
+        for t in range(frames):
+            moved = min(max(t - steer, 0) * PLAYER_VEL, abs(distance))
+            x = takeoff + (moved if distance > 0 else -moved)
+            y = top + offsets[t] if t < frames - 1 else end_y - PLAYER_SPRITE_SIZE
+            hitbox = pygame.Rect(x + hx, y + hy, hw, hh)
+            if t >= steer and moved < abs(distance):
+                # handle_move only lets the player move if a probe
+                # PLAYER_VEL * 2 ahead is clear.
+                hitbox.union_ip(hitbox.move(probe, 0))
+            swept.union_ip(hitbox)
+            if self.terrain.query(hitbox):
+                return False, swept
+        return True, swept
+
+    def update(self, rect):
+        """
+        Rebuild the surfaces and edges a terrain change can affect.
+
+        Called by the TerrainGrid whenever a block is added, removed, moved
+        or resized.
+
+        Args:
+            rect (pygame.Rect): Area that changed.
+        """
+        hh = self.hitbox[3] - self.hitbox[1]
+        band = pygame.Rect(rect.left - 1, rect.top, rect.width + 2, rect.height + hh)
+        # Grow the band sideways until it covers whole surfaces, old and new.
+        while True:
+            old = self.surfaces_in(band.inflate(2, 0))
+            new = self._find_surfaces(band)
+            spans = [self.surfaces[sid] for sid in old] + new
+            left = min([band.left] + [surface.left - 1 for surface in spans])
+            right = max([band.right] + [surface.right + 1 for surface in spans])
+            if (left, right) == (band.left, band.right):
+                break
+            band.left, band.width = left, right - left
+        self._replace(old, new)
+
+        # Moves between untouched surfaces that flew through the change.
+        changed = rect.inflate(2, 2)
+        pairs = set()
+        for key in self.terrain._keys(changed, self.terrain.chunk_size):
+            pairs.update(self.checked_cells.get(key, ()))
+        for pair in sorted(pairs):
+            if pair in self.checked and self.checked[pair].colliderect(changed):
+                self._connect(*pair)
+
+    def surface_at(self, rect):
+        """
+        Find the surface a sprite rect is standing on.
+
+        Args:
+            rect (pygame.Rect): Player sprite rect.
+
+        Returns:
+            int: Surface id, or None while airborne.
+        """
+        middle = (self.hitbox[0] + self.hitbox[2]) // 2
+        for sid in self.surfaces_in(pygame.Rect(rect.x + middle, rect.bottom - 1, 1, 2)):
+            lo, hi = self.standing_range(self.surfaces[sid])
+            if lo <= rect.x <= hi:
+                return sid
+        return None
+
+    def goals_for(self, rect):
+        """
+        Find the surfaces from which a jump reaches an area, e.g. a mango.
+
+        Args:
+            rect (pygame.Rect): Target area.
+
+        Returns:
+            list: Surface ids.
+        """
+        left, top, right, bottom = self.hitbox
+        middle, height = (left + right) // 2, bottom - top
+        area = pygame.Rect(rect.left - right + middle, rect.top,
+                           rect.width + right - left + 1, rect.height + self.max_rise + height)
+        goals = []
+        for sid in self.surfaces_in(area):
+            surface = self.surfaces[sid]
+            lo, hi = self.standing_range(surface)
+            over = rect.left - right < hi and lo < rect.right - left
+            if over and surface.y - self.max_rise - height < rect.bottom and rect.top < surface.y:
+                goals.append(sid)
+        return goals
+
+    def find_path(self, source, goals, start_x=None):
+        """
+        A* search over the surfaces.
+
+        Edge costs are frames: walking from where the player landed on a
+        surface to the edge's takeoff point, then the flight time. The
+        heuristic is the horizontal distance to the nearest goal surface at
+        PLAYER_VEL, which never overestimates.
+
+        Args:
+            source (int): Starting surface id.
+            goals (iterable): Surface ids that count as arriving.
+            start_x (int, optional): Sprite x-position on the source surface.
+                Defaults to the middle of the surface.
+
+        Returns:
+            list: NavEdge moves to follow, or None if no goal is reachable.
+        """
+        goals = set(goals)
+        if not goals or source not in self.surfaces:
+            return None
+        if start_x is None:
+            start_x = sum(self.standing_range(self.surfaces[source])) / 2
+        goal_ranges = [self.standing_range(self.surfaces[goal]) for goal in goals]
+
+        def estimate(x):
+            return min(max(0, low - x, x - high) for low, high in goal_ranges) / PLAYER_VEL
+
+        best = {source: 0}
+        came_from = {}
+        frontier = [(estimate(start_x), 0, source, start_x)]
+        while frontier:
+            _, cost, sid, x = heapq.heappop(frontier)
+            if sid in goals:
+                path = []
+                while sid != source:
+                    edge = came_from[sid]
+                    path.append(edge)
+                    sid = edge.source
+                return path[::-1]
+            if cost > best[sid]:
+                continue
+            for target, edge in self.edges[sid].items():
+                new_cost = cost + abs(edge.takeoff - x) / PLAYER_VEL + edge.frames
+                if new_cost < best.get(target, math.inf):
+                    best[target] = new_cost
+                    came_from[target] = edge
+                    heapq.heappush(frontier, (new_cost + estimate(edge.landing), new_cost,
+                                              target, edge.landing))
+        return None
+
+    def path_to_mango(self, player, mango):
+        """
+        Plan the moves from where the player stands to a mango.
+
+        Args:
+            player (Player): Player standing on a surface.
+            mango (Mango): Mango to reach.
+
+        Returns:
+            list: NavEdge moves (empty if the mango is reachable from here),
+            or None if the player is airborne or the mango is unreachable.
+        """
+        source = self.surface_at(player.rect)
+        if source is None:
+            return None
+        return self.find_path(source, self.goals_for(mango.rect), player.rect.x)
+
+
+# -------------------- Endless Mode --------------------
+CHUNK_BLOCKS = 16  # chunk width in blocks
+
+Chunk = namedtuple("Chunk", ["index", "blocks", "mangoes", "fires"])
+Chunk.__doc__ = """
+Plain-data description of one endless-mode chunk, in the same formats as
+the "blocks", "mangoes" and "fires" entries of default_layout().
+"""
+
+
+def generate_chunk(seed, index, block_size=96):
+    """
+    Generate the terrain and entities of one endless-mode chunk.
+
+    Only plain data is produced, so this is safe to run off the main thread.
+    The same seed and index always give the same chunk.
+
+    Args:
+        seed (int): World seed.
+        index (int): Chunk number; chunk 0 contains the starting position.
+        block_size (int): Size of a terrain block.
+
+    Returns:
+        Chunk: The generated chunk.
+    """
+    rng = random.Random(f"{seed}:{index}")
+    left = index * CHUNK_BLOCKS * block_size
+    floor_y = HEIGHT - block_size
+    safe = index <= 0  # nothing dangerous where the player spawns or behind it
+
+    blocks, mangoes, fires = [], [], []
+    gap_until = -1
+    last_gap = 0
+    for column in range(CHUNK_BLOCKS):
+        x = left + column * block_size
+        # Chunks always start with floor so a respawn has somewhere to land.
+        if not safe and 2 <= column < CHUNK_BLOCKS - 2 and column - last_gap > 3 \
+                and rng.random() < 0.15:
+            gap_until = column + rng.randint(1, 2)
+            last_gap = gap_until
+        if column < gap_until:
+            continue
+        blocks.append((x, floor_y))
+        if not safe and column > 1 and column + 1 != gap_until and rng.random() < 0.12:
+            fires.append((x + block_size // 2, floor_y - 64, 16, 32))
+        elif rng.random() < 0.15:
+            mangoes.append((x + 20, floor_y - 60, 50, 50))
+
+    for _ in range(rng.randint(1, 3)):
+        length = rng.randint(1, 3)
+        column = rng.randint(0, CHUNK_BLOCKS - length)
+        rows = rng.randint(2, 4)
+        y = HEIGHT - block_size * rows
+        for i in range(length):
+            x = left + (column + i) * block_size
+            blocks.append((x, y))
+            if rng.random() < 0.6:
+                mangoes.append((x + 20, y - 60, 50, 50))
+    return Chunk(index, blocks, mangoes, fires)
+
+
+class EndlessWorld:
+    """
+    Streams procedurally generated chunks around the camera.
+
+    A background thread generates chunk data ahead of the camera; update()
+    on the main thread only turns ready chunks into entities and retires
+    the ones that left the window, so frame time and memory stay flat no
+    matter how far the player runs. Chunks that come back into range are
+    regenerated from the seed, including any mangoes already collected.
+    """
+    def __init__(self, level, seed, ahead=2, behind=1, per_frame=1):
+        """
+        Start the generator thread for a level.
+
+        Args:
+            level (Level): Level to stream chunks into (usually empty).
+            seed (int): World seed.
+            ahead (int): Chunks kept loaded past the right edge of the view.
+            behind (int): Chunks kept loaded past the left edge of the view.
+            per_frame (int): Most chunks materialized in one update().
+        """
+        self.level = level
+        self.seed = seed
+        self.ahead = ahead
+        self.behind = behind
+        self.per_frame = per_frame
+        self.chunk_width = CHUNK_BLOCKS * level.block_size
+        self.loaded = {}
+        self.pending = set()
+        self.requests = queue.Queue()
+        self.ready = queue.Queue()
+        self.thread = threading.Thread(target=self._generate, daemon=True)
+        self.thread.start()
+
+    def _generate(self):
+        while True:
+            index = self.requests.get()
+            if index is None:
+                return
+            self.ready.put(generate_chunk(self.seed, index, self.level.block_size))
+
+    def window(self, offset_x, view_width=WIDTH):
+        """
+        Get the range of chunk indexes that should be loaded.
+
+        Args:
+            offset_x (int): Camera x-offset.
+            view_width (int): Width of the visible area.
+
+        Returns:
+            range: Chunk indexes.
+        """
+        first = offset_x // self.chunk_width - self.behind
+        last = (offset_x + view_width) // self.chunk_width + self.ahead
+        return range(first, last + 1)
+
+    def update(self, offset_x, view_width=WIDTH):
+        """
+        Request, materialize and retire chunks for the current camera.
+
+        Args:
+            offset_x (int): Camera x-offset.
+            view_width (int): Width of the visible area.
+        """
+        wanted = self.window(offset_x, view_width)
+        for index in wanted:
+            if index not in self.loaded and index not in self.pending:
+                self.pending.add(index)
+                self.requests.put(index)
+
+        for _ in range(self.per_frame):
+            try:
+                chunk = self.ready.get_nowait()
+            except queue.Empty:
+                break
+            self.pending.discard(chunk.index)
+            if chunk.index in wanted and chunk.index not in self.loaded:
+                self._materialize(chunk)
+
+        for index in [index for index in self.loaded if index not in wanted]:
+            self._retire(index)
+
+    def _materialize(self, chunk):
+        level = self.level
+        size = level.block_size
+        blocks = [Block(x, y, size) for x, y in chunk.blocks]
+        mangoes = [Mango(*rect) for rect in chunk.mangoes]
+        fires = [Fire(*rect) for rect in chunk.fires]
+        for block in blocks:
+            level.terrain.add(block)
+        for mango in mangoes:
+            level.mangoes.append(mango)
+            level.objects.append(mango)
+        for fire in fires:
+            fire.on()
+            level.fires.append(fire)
+            level.objects.append(fire)
+            level.hazards.add(fire, on_ticks=FPS * 2, off_ticks=FPS)
+        self.loaded[chunk.index] = (blocks, mangoes, fires)
+
+    def _retire(self, index):
+        level = self.level
+        blocks, mangoes, fires = self.loaded.pop(index)
+        for block in blocks:
+            if block.terrain is not None:
+                level.terrain.remove(block)
+        left = index * self.chunk_width
+        level.terrain.prune(pygame.Rect(left, -HEIGHT, self.chunk_width, HEIGHT * 3))
+        for mango in mangoes:
+            level.mangoes.remove(mango)
+            if not mango.collected:
+                level.objects.remove(mango)
+        for fire in fires:
+            level.hazards.remove(fire)
+            level.fires.remove(fire)
+            level.objects.remove(fire)
+
+    def respawn_point(self, offset_x):
+        """
+        Get a safe place to put the player back after a fall.
+
+        The leftmost floor block in view with nothing in the way and no fire
+        nearby is used. If the view has none, the start of the chunk in view
+        is used instead (chunks always start with floor) and the camera is
+        moved there.
+
+        Args:
+            offset_x (int): Camera x-offset.
+
+        Returns:
+            tuple: (x, y) above the floor, inside the view.
+        """
+        level = self.level
+        size = level.block_size
+        y = HEIGHT - size * 2
+        floor = pygame.Rect(offset_x, HEIGHT - size, WIDTH, size)
+        fires = [fire.image.get_rect(topleft=fire.rect.topleft) for fire in level.fires]
+        for block in sorted(level.terrain.query(floor), key=lambda block: block.rect.x):
+            drop = pygame.Rect(block.rect.x + 16, y, PLAYER_SPRITE_SIZE, floor.top - y)
+            if (floor.left <= drop.left and drop.right <= floor.right
+                    and block.rect.top == floor.top and not level.terrain.query(drop)
+                    and drop.inflate(PLAYER_VEL * 4, 0).collidelist(fires) < 0):
+                return drop.topleft
+
+        index = (offset_x + WIDTH // 2) // self.chunk_width
+        x = index * self.chunk_width + 16
+        level.offset_x = x - size
+        return x, y
+
+    def close(self):
+        """
+        Stop the generator thread.
+        """
+        self.requests.put(None)
+        self.thread.join(timeout=1)
+
+
+# -------------------- Memory Accounting --------------------
+def surface_bytes(surface):
+    """
+    Get the pixel memory owned by a surface.
+
+    Args:
+        surface (pygame.Surface): Surface to measure.
+
+    Returns:
+        int: Bytes of pixel data; 0 for subsurfaces, which share their parent's.
+    """
+    if surface.get_parent() is not None:
+        return 0
+    return surface.get_pitch() * surface.get_height()
+
+
+def mask_bytes(mask):
+    """
+    Get the approximate memory held by a collision mask.
+
+    Args:
+        mask (pygame.mask.Mask): Mask to measure.
+
+    Returns:
+        int: Bytes of bit data, stored as 64-bit words per row.
+    """
+    width, height = mask.get_size()
+    return (width + 63) // 64 * 8 * height
+
+
+class MemoryLedger:
+    """
+    Tallies surfaces and masks into named groups.
+
+    Each object is counted once, under the first group that reports it, so
+    frames shared through the asset caches are not charged to every entity
+    that points at them. Distinct surfaces with identical pixels are
+    counted as duplicates.
+    """
+    def __init__(self):
+        """
+        Create an empty ledger.
+        """
+        self.groups = {}
+        self.seen = {}  # id -> object, kept alive so ids stay unique
+        self.contents = set()
+        self.duplicates = {}
+
+    def _group(self, group):
+        if group not in self.groups:
+            self.groups[group] = {"surfaces": 0, "surface_bytes": 0,
+                                  "masks": 0, "mask_bytes": 0}
+        return self.groups[group]
+
+    def add_surface(self, group, surface):
+        """
+        Count a surface under a group.
+
+        Args:
+            group (str): Group name.
+            surface (pygame.Surface): Surface to count.
+        """
+        entry = self._group(group)
+        if surface is None or id(surface) in self.seen:
+            return
+        self.seen[id(surface)] = surface
+        size = surface_bytes(surface)
+        entry["surfaces"] += 1
+        entry["surface_bytes"] += size
+        key = (surface.get_size(), hash(pygame.image.tobytes(surface, "RGBA")))
+        if key in self.contents:
+            duplicate = self.duplicates.setdefault(group, {"surfaces": 0, "bytes": 0})
+            duplicate["surfaces"] += 1
+            duplicate["bytes"] += size
+        self.contents.add(key)
+
+    def add_mask(self, group, mask):
+        """
+        Count a collision mask under a group.
+
+        Args:
+            group (str): Group name.
+            mask (pygame.mask.Mask): Mask to count.
+        """
+        entry = self._group(group)
+        if mask is None or id(mask) in self.seen:
+            return
+        self.seen[id(mask)] = mask
+        entry["masks"] += 1
+        entry["mask_bytes"] += mask_bytes(mask)
+
+    def add_sprites(self, group, sprites):
+        """
+        Count every surface in a sprite dict or frame list.
+
+        Args:
+            group (str): Group name.
+            sprites (dict | list): Sprite sheets as returned by load_sprite_sheets().
+        """
+        for frames in (sprites.values() if isinstance(sprites, dict) else [sprites]):
+            for surface in frames:
+                self.add_surface(group, surface)
+
+    def add_entity(self, group, entity):
+        """
+        Count the image and mask held by an entity.
+
+        Args:
+            group (str): Group name, usually the entity class.
+            entity (pygame.sprite.Sprite): Player, Block, Mango or Fire.
+        """
+        self.add_surface(group, getattr(entity, "sprite", None) or getattr(entity, "image", None))
+        self.add_mask(group, getattr(entity, "mask", None))
+
+
+def memory_report(level=None, particles=None):
+    """
+    Report the memory held by surfaces and masks, grouped by asset and entity type.
+
+    Args:
+        level (Level, optional): Level whose entities and terrain to include.
+        particles (ParticleSystem, optional): Particle system whose frames to include.
+
+    Returns:
+        dict: "groups" (surface/mask counts and bytes per group), "entities"
+        (live entity counts), "duplicates" (surfaces whose pixels repeat an
+        earlier surface) and "total_bytes".
+    """
+    ledger = MemoryLedger()
+    ledger.add_sprites("Player.SPRITES", Player.SPRITES)
+    for (dir1, dir2, width, height), sprites in _SPRITE_SHEETS.items():
+        ledger.add_sprites(f"{dir1}/{dir2} {width}x{height}", sprites)
+    for surface in _MANGO_IMAGES.values():
+        ledger.add_surface("mango images", surface)
+    for surface in _BLOCK_SURFACES.values():
+        ledger.add_surface("block surfaces", surface)
+    if particles is not None:
+        ledger.add_sprites("particle frames", particles._frames)
+    for table in _ANIMATION_TABLES.values():
+        for masks in table.masks:
+            for mask in masks:
+                ledger.add_mask("animation masks", mask)
+
+    entities = {}
+    if level is not None:
+        for chunk in level.terrain.chunks.values():
+            ledger.add_surface("terrain chunks", chunk)
+        blocks = {block: None for cell in level.terrain.cells.values() for block in cell}
+        ledger.add_entity("Player", level.player)
+        for group, members in (("Block", blocks), ("Mango", level.mangoes),
+                               ("Fire", level.fires)):
+            entities[group] = len(members)
+            for entity in members:
+                ledger.add_entity(group, entity)
+
+    total = sum(group["surface_bytes"] + group["mask_bytes"]
+                for group in ledger.groups.values())
+    return {
+        "groups": ledger.groups,
+        "entities": entities,
+        "duplicates": {
+            "surfaces": sum(entry["surfaces"] for entry in ledger.duplicates.values()),
+            "bytes": sum(entry["bytes"] for entry in ledger.duplicates.values()),
+            "by_group": ledger.duplicates,
+        },
+        "total_bytes": total,
+    }
+
+
+class MemoryMonitor:
+    """
+    Refreshes memory_report() periodically for the debug overlay (F3) and
+    appends it to a JSON Lines file for long soak runs.
+    """
+    def __init__(self, interval=FPS, dump_path=None, dump_every=FPS * 60):
+        """
+        Create a hidden monitor.
+
+        Args:
+            interval (int): Frames between report refreshes while the overlay is shown.
+            dump_path (str, optional): File to append a JSON report to.
+            dump_every (int): Frames between dumps.
+        """
+        self.interval = interval
+        self.dump_path = dump_path
+        self.dump_every = dump_every
+        self.visible = False
+        self.report = None
+        self.frame = 0
+        self.font = None
+
+    def update(self, level, particles=None):
+        """
+        Count a frame, refreshing the report and dumping it when due.
+
+        Args:
+            level (Level): The running level.
+            particles (ParticleSystem, optional): The particle system.
+        """
+        self.frame += 1
+        dump = self.dump_path is not None and self.frame % self.dump_every == 0
+        refresh = self.visible and (self.report is None or self.frame % self.interval == 0)
+        if dump or refresh:
+            self.report = memory_report(level, particles)
+        if dump:
+            self.dump()
+
+    def dump(self):
+        """
+        Append the current report as one JSON line to dump_path.
+        """
+        record = {"time": time.time(), "frame": self.frame, **self.report}
+        with open(self.dump_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def toggle(self):
+        """
+        Show or hide the overlay.
+        """
+        self.visible = not self.visible
+        self.report = None
+
+    def lines(self):
+        """
+        Format the current report for the overlay.
+
+        Returns:
+            list: Text lines.
+        """
+        report = self.report
+        if report is None:
+            return []
+        lines = [f"Memory: {report['total_bytes'] / 2 ** 20:.2f} MB"]
+        for name, group in report["groups"].items():
+            lines.append(f"{name}: {group['surfaces']} surf {group['surface_bytes'] // 1024} KB,"
+                         f" {group['masks']} masks {group['mask_bytes'] // 1024} KB")
+        counts = ", ".join(f"{name} {count}" for name, count in report["entities"].items())
+        lines.append(f"Entities: {counts}")
+        duplicates = report["duplicates"]
+        lines.append(f"Duplicates: {duplicates['surfaces']} surf"
+                     f" {duplicates['bytes'] // 1024} KB")
+        return lines
+
+    def draw(self, win):
+        """
+        Draw the overlay in the top-left corner.
+
+        Args:
+            win (pygame.Surface): Game window surface.
+        """
+        if self.font is None:
+            self.font = pygame.font.SysFont("monospace", 16)
+        lines = self.lines()
+        if not lines:
+            return
+        height = self.font.get_linesize()
+        panel = pygame.Surface((520, height * len(lines) + 10), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 160))
+        for i, line in enumerate(lines):
+            panel.blit(self.font.render(line, True, (255, 255, 255)), (5, 5 + i * height))
+        win.blit(panel, (10, 10))
+
 
 # -------------------- Start Screen --------------------
 def start_screen(window):
     """
-    Display the start screen and wait until the user presses SPACE.
+    Display the start screen and wait until the user presses SPACE or E.
+
+    Returns:
+        bool: True if the player picked endless mode (E).
     """
     run = True
     font = pygame.font.SysFont("comicsans", 60)
@@ -639,11 +4312,13 @@ def start_screen(window):
         window.fill((0, 150, 255))
         title_text = font.render("Welcome to Mango Masters!", True, (255, 255, 0))
         start_text = small_font.render("Press SPACE to start", True, (255, 255, 255))
+        endless_text = small_font.render("Press E for endless mode", True, (255, 255, 255))
         
         window.blit(title_text, (WIDTH//2 - title_text.get_width()//2, HEIGHT//3))
         window.blit(start_text, (WIDTH//2 - start_text.get_width()//2, HEIGHT//2))
+        window.blit(endless_text, (WIDTH//2 - endless_text.get_width()//2, HEIGHT//2 + 60))
         
-        pygame.display.update()
+        display.present()
         
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -651,7 +4326,9 @@ def start_screen(window):
                 quit()
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE:
-                    run = False
+                    return False
+                if event.key == pygame.K_e:
+                    return True
 # -------------------- Win Screen --------------------
 def win_screen(window):
     """
@@ -672,7 +4349,7 @@ def win_screen(window):
         window.blit(msg_text, (WIDTH // 2 - msg_text.get_width() // 2, HEIGHT // 2))
         window.blit(exit_text, (WIDTH // 2 - exit_text.get_width() // 2, HEIGHT // 1.5))
 
-        pygame.display.update()
+        display.present()
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -685,67 +4362,43 @@ def win_screen(window):
 
 
 # -------------------- Main Game --------------------
-def main(window):
+def main(window, memory_dump=None, memory_dump_every=60):
     """
     Initialize the game objects and run the main game loop.
+
+    Args:
+        window (pygame.Surface): Surface to draw the game into.
+        memory_dump (str, optional): File to append periodic memory reports to.
+        memory_dump_every (int): Seconds between memory reports.
     """
-    start_screen(window)
+    endless = start_screen(window)
 
     clock = pygame.time.Clock()
     background, bg_image = get_background("Blue.png")
 
-    block_size = 96
-
-    # Player
-    player = Player(100, HEIGHT - block_size * 2, 50, 50)
-
-    # Fire trap
-    fire = Fire(1400, HEIGHT - block_size - 64, 16, 32)
-    fire.on()
-
-    floor = [
-        Block(i * block_size, HEIGHT - block_size, block_size)
-        for i in range(-5, 40)
-    ]
-
-    # -------------------- PLATFORMS --------------------
-    platforms = [
-        Block(200, HEIGHT - block_size * 2, block_size),
-        Block(350, HEIGHT - block_size * 3, block_size),
-
-        Block(500, HEIGHT - block_size * 4, block_size),
-        Block(600, HEIGHT - block_size * 4, block_size),
-        Block(700, HEIGHT - block_size * 4, block_size),
+    world = None
+    if endless:
+        level = Level(Player(100, HEIGHT - 96 * 2, 50, 50), [], [], [])
+        world = EndlessWorld(level, seed=random.randrange(2 ** 32))
+    else:
+        level = build_level()
+    player = level.player
+    objects = level.objects
+    rewind = RewindBuffer(seconds=5)
+    particles = create_particles()
+    governor = QualityGovernor()
+    renderer = DirtyRenderer()
+    monitor = MemoryMonitor(dump_path=memory_dump, dump_every=FPS * memory_dump_every)
 
-        Block(900, HEIGHT - block_size * 3, block_size),
-    ]
-
-    # -------------------- MANGOES --------------------
-    mangoes = [
-        Mango(520, HEIGHT - block_size * 4 - 60, 50, 50),
-        Mango(620, HEIGHT - block_size * 4 - 60, 50, 50),
-        Mango(720, HEIGHT - block_size * 4 - 60, 50, 50),
-
-        Mango(360, HEIGHT - block_size * 3 - 60, 50, 50),
-        Mango(920, HEIGHT - block_size * 3 - 60, 50, 50),
-
-        Mango(600, HEIGHT - block_size - 60, 50, 50),
-        Mango(1100, HEIGHT - block_size - 60, 50, 50),
-    ]
-
-    objects = [
-        *floor,
-        *platforms,
-        *mangoes,
-        fire
-    ]
-
-    offset_x = 0
     scroll_area_width = 200
 
     run = True
     while run:
         clock.tick(FPS)
+        ANIMATION_CLOCK.advance()
+        governor.record(clock.get_rawtime())
+        governor.apply(level.hazards, particles)
+        bg = None if governor.solid_background else bg_image
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -754,30 +4407,88 @@ def main(window):
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE and player.jump_count < 2:
                     player.jump()
+                if event.key == pygame.K_F11:
+                    display.toggle_fullscreen()
+                    renderer.invalidate()
+                if event.key == pygame.K_F3:
+                    monitor.toggle()
+                    renderer.invalidate()
+                if world is not None:
+                    continue  # save/load only covers the hand-built level
+                if event.key == pygame.K_F5:
+                    save_snapshot(SAVE_PATH, capture_snapshot(level))
+                if event.key == pygame.K_F9:
+                    try:
+                        restore_snapshot(level, load_snapshot(SAVE_PATH))
+                        rewind.clear()
+                    except (FileNotFoundError, ValueError) as e:
+                        print(f"Could not load save: {e}")
+
+        # -------------------- REWIND --------------------
+        if pygame.key.get_pressed()[pygame.K_r] and len(rewind):
+            restore_snapshot(level, rewind.pop())
+            renderer.draw(window, background, bg, player, objects, level.offset_x,
+                          level.terrain, particles)
+            continue
+
+        if world is not None:
+            world.update(level.offset_x)
 
         player.loop(FPS)
-        fire.loop()
-        handle_move(player, objects)
-
-        # -------------------- WIN CONDITION --------------------
-        remaining_mangoes = [
-            obj for obj in objects
-            if getattr(obj, "name", None) == "mango"
-        ]
-
-        if len(remaining_mangoes) == 0:
-            win_screen(window)
-
-        draw(window, background, bg_image, player, objects, offset_x)
+        level.hazards.update(player, level.offset_x)
+        particles.update()
+        handle_move(player, objects, level.terrain, particles,
+                    governor.rect_reject)
+
+        if world is not None:
+            # Endless mode has no win screen or rewind; falling just respawns.
+            if player.rect.top > HEIGHT:
+                player.rect.topleft = world.respawn_point(level.offset_x)
+                player.x_vel = player.y_vel = 0
+                player.fall_count = 0
+        else:
+            rewind.push(capture_snapshot(level))
+
+            # -------------------- WIN CONDITION --------------------
+            if len(level.remaining_mangoes()) == 0:
+                win_screen(window)
+
+        monitor.update(level, particles)
+        if monitor.visible:
+            render_scene(window, background, bg, player, objects, level.offset_x,
+                         level.terrain, particles)
+            monitor.draw(window)
+            display.present()
+            renderer.invalidate()
+        else:
+            renderer.draw(window, background, bg, player, objects, level.offset_x,
+                          level.terrain, particles)
 
         # Camera scrolling
-        if ((player.rect.right - offset_x >= WIDTH - scroll_area_width) and player.x_vel > 0) or \
-           ((player.rect.left - offset_x <= scroll_area_width) and player.x_vel < 0):
-            offset_x += player.x_vel
+        level.update_camera(scroll_area_width)
 
+    if world is not None:
+        world.close()
     pygame.quit()
     quit()
 
 
 if __name__ == "__main__":
-    main(window)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Play Mango Masters.")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="integer window scale, GPU-scaled when possible (default: 1)")
+    parser.add_argument("--scaled", action="store_true",
+                        help="use SDL's GPU scaling even at scale 1")
+    parser.add_argument("--vsync", action="store_true",
+                        help="sync to the monitor refresh (implies --scaled)")
+    parser.add_argument("--fullscreen", action="store_true",
+                        help="start in fullscreen")
+    parser.add_argument("--memory-dump", metavar="PATH",
+                        help="append a JSON memory report to PATH periodically")
+    parser.add_argument("--memory-dump-every", type=int, default=60, metavar="SECONDS",
+                        help="seconds between memory reports (default: 60)")
+    args = parser.parse_args()
+    display.open(args.scale, args.scaled, args.vsync, args.fullscreen)
+    main(display.surface, args.memory_dump, args.memory_dump_every)
@@ -183,3 +183,738 @@ def test_get_background_raises_filenotfound_for_missing_file(mm, monkeypatch):
     with pytest.raises(FileNotFoundError):
         mm.get_background("DefinitelyMissing.png")
 
+
+
+def test_terrain_grid_query_finds_only_nearby_blocks(mm):
+    terrain = mm.TerrainGrid(cell_size=32, chunk_size=64)
+    near = mm.Block(0, 0, 32)
+    far = mm.Block(640, 0, 32)
+    terrain.add(near)
+    terrain.add(far)
+
+    assert terrain.query(mm.pygame.Rect(0, 0, 40, 40)) == [near]
+    assert len(terrain) == 2
+
+
+def test_terrain_grid_destroy_updates_index_and_rendered_layer(mm):
+    terrain = mm.TerrainGrid(cell_size=32, chunk_size=64)
+    b = mm.Block(0, 0, 32)
+    terrain.add(b)
+    assert terrain.chunks[(0, 0)].get_at((5, 5)).a == 255
+
+    b.destroy()
+
+    assert terrain.query(b.rect) == []
+    assert terrain.chunks[(0, 0)].get_at((5, 5)).a == 0
+    assert b.terrain is None
+
+
+def test_terrain_grid_move_reindexes_block(mm):
+    terrain = mm.TerrainGrid(cell_size=32, chunk_size=64)
+    b = mm.Block(0, 0, 32)
+    terrain.add(b)
+
+    b.move(100, 0)
+
+    assert terrain.query(mm.pygame.Rect(0, 0, 32, 32)) == []
+    assert terrain.query(mm.pygame.Rect(100, 0, 32, 32)) == [b]
+    assert terrain.chunks[(1, 0)].get_at((100 - 64 + 1, 1)).a == 255
+
+
+def test_terrain_grid_shows_block_highlight(mm):
+    terrain = mm.TerrainGrid(cell_size=32, chunk_size=64)
+    b = mm.Block(0, 0, 32)
+    terrain.add(b)
+
+    b.highlight((0, 255, 0))
+
+    assert tuple(terrain.chunks[(0, 0)].get_at((0, 0)))[:3] == (0, 255, 0)
+
+
+def particle_system(mm, capacity=16):
+    particles = mm.ParticleSystem(capacity, seed=0)
+    frame = mm.pygame.Surface((4, 4), mm.pygame.SRCALPHA)
+    frame.fill((255, 0, 0, 255))
+    particles.add_effect("dot", [frame])
+    return particles
+
+
+def test_particles_expire_after_their_lifetime(mm):
+    particles = particle_system(mm)
+    particles.emit("dot", 10, 10, 5, life=3)
+    assert len(particles) == 5
+
+    for _ in range(3):
+        particles.update()
+
+    assert len(particles) == 0
+
+
+def test_particles_pool_never_grows_past_capacity(mm):
+    particles = particle_system(mm, capacity=4)
+    assert particles.emit("dot", 0, 0, 10) == 4
+    assert particles.emit("dot", 0, 0, 1) == 0
+
+
+def test_particles_draw_in_one_batch(mm):
+    particles = particle_system(mm)
+    particles.emit("dot", 20, 20, 1, speed=0)
+    win = mm.pygame.Surface((50, 50), mm.pygame.SRCALPHA)
+
+    particles.draw(win, 0)
+
+    assert win.get_at((20, 20)).r == 255
+
+
+def test_timer_wheel_fires_after_delay_longer_than_the_wheel(mm):
+    wheel = mm.TimerWheel(slots=4)
+    fired = []
+    wheel.schedule(10, lambda: fired.append(wheel.tick_count))
+
+    for _ in range(12):
+        wheel.advance()
+
+    assert fired == [10]
+
+
+def test_hazard_scheduler_sleeps_far_traps_and_resumes_on_clock_phase(mm):
+    player = mm.Player(0, 0, 10, 10)
+    near = mm.Fire(100, 0, 16, 32)
+    far = mm.Fire(5000, 0, 16, 32)
+    frames = [mm.pygame.Surface((32, 64), mm.pygame.SRCALPHA) for _ in range(4)]
+    far.fire = {"on": frames, "off": frames[:1]}
+    far.animations = mm.get_animation_table(far.fire, far.STATES, delay=far.ANIMATION_DELAY)
+    far.on()
+    sleeping_image = far.image
+    hazards = mm.HazardScheduler()
+    hazards.add(near)
+    hazards.add(far)
+
+    for _ in range(5):
+        mm.ANIMATION_CLOCK.advance()
+        hazards.update(player, offset_x=0)
+    assert near.animation_count == 5
+    assert far.image is sleeping_image
+
+    mm.ANIMATION_CLOCK.advance()
+    hazards.update(player, offset_x=4500)
+
+    assert far.image is frames[6 // far.ANIMATION_DELAY % 4]
+
+
+def test_hazard_scheduler_drives_on_off_cycle(mm):
+    player = mm.Player(0, 0, 10, 10)
+    fire = mm.Fire(100, 0, 16, 32)
+    fire.on()
+    hazards = mm.HazardScheduler()
+    hazards.add(fire, on_ticks=3, off_ticks=2)
+
+    states = []
+    for _ in range(6):
+        hazards.update(player, offset_x=0)
+        states.append(fire.animation_name)
+
+    assert states == ["on", "on", "off", "off", "on", "on"]
+
+
+def test_snapshot_restore_rolls_back_player_and_mangoes(mm):
+    level = mm.build_level()
+    before = mm.capture_snapshot(level)
+
+    mango = level.mangoes[0]
+    level.objects.remove(mango)
+    mango.collected = True
+    level.player.score = 1
+    level.player.rect.x += 300
+    level.offset_x = 250
+
+    mm.restore_snapshot(level, before)
+
+    assert not mango.collected and mango in level.objects
+    assert level.player.score == 0
+    assert level.player.rect.x == before.x
+    assert level.offset_x == 0
+
+
+def test_snapshot_restore_shows_restored_animation_frames(mm):
+    level = mm.build_level()
+    frames = [mm.pygame.Surface((32, 64), mm.pygame.SRCALPHA) for _ in range(4)]
+    fire = level.fires[0]
+    fire.fire = {"on": frames, "off": frames[:1]}
+    fire.animations = mm.get_animation_table(fire.fire, fire.STATES, delay=fire.ANIMATION_DELAY)
+    fire.on()
+    fire.animation_count = 7
+    player = level.player
+    sprites = {f"{state}_{direction}": frames for state in player.STATES
+               for direction in player.DIRECTIONS}
+    player.animations = mm.get_animation_table(sprites, player.STATES, player.DIRECTIONS)
+    player.animation_count = 7
+    before = mm.capture_snapshot(level)
+
+    fire.off()
+    fire.animation_count = 0
+    fire.loop()
+    player.animation_count = 0
+    player.update_sprite()
+    mm.restore_snapshot(level, before)
+
+    assert fire.image is frames[7 // fire.ANIMATION_DELAY]
+    assert player.sprite is frames[7 // player.ANIMATION_DELAY]
+
+
+def test_snapshot_restore_replays_fire_cycles(mm):
+    level = mm.build_level()
+    for _ in range(50):
+        level.hazards.update(level.player, level.offset_x)
+    before = mm.capture_snapshot(level)
+
+    def play():
+        states = []
+        for _ in range(200):
+            level.hazards.update(level.player, level.offset_x)
+            states.append([fire.animation_name for fire in level.fires])
+        return states
+
+    first = play()
+    mm.restore_snapshot(level, before)
+    assert play() == first
+
+
+def test_snapshot_save_and_load_round_trip(mm, tmp_path):
+    level = mm.build_level()
+    level.mangoes[2].collected = True
+    level.player.y_vel = -3.5
+    snapshot = mm.capture_snapshot(level)
+    path = tmp_path / "save.mmsave"
+
+    mm.save_snapshot(path, snapshot)
+
+    assert mm.load_snapshot(path) == snapshot
+
+
+def test_load_snapshot_rejects_truncated_files(mm, tmp_path):
+    path = tmp_path / "save.mmsave"
+    mm.save_snapshot(path, mm.capture_snapshot(mm.build_level()))
+    path.write_bytes(path.read_bytes()[:-2])
+
+    with pytest.raises(ValueError):
+        mm.load_snapshot(path)
+
+
+def test_rewind_buffer_keeps_only_the_newest_snapshots(mm):
+    rewind = mm.RewindBuffer(seconds=1, fps=3)
+    for i in range(5):
+        rewind.push(i)
+
+    assert len(rewind) == 3
+    assert [rewind.pop(), rewind.pop(), rewind.pop(), rewind.pop()] == [4, 3, 2, None]
+
+
+def test_quality_governor_degrades_under_load_and_recovers(mm):
+    governor = mm.QualityGovernor(budget_ms=10, smoothing=1.0, cooldown=2)
+    for _ in range(4):
+        governor.record(25)
+    assert governor.tier == 2
+    assert governor.far_animation_stride > 1
+    assert governor.rect_reject
+
+    for _ in range(20):
+        governor.record(2)
+    assert governor.tier == 0
+    assert governor.tier_name == "full"
+
+
+def test_quality_governor_lowers_particle_density(mm):
+    governor = mm.QualityGovernor()
+    governor.tier = 3
+    particles = particle_system(mm, capacity=64)
+    hazards = mm.HazardScheduler()
+
+    governor.apply(hazards, particles)
+
+    assert particles.emit("dot", 0, 0, 16) == 4
+    assert particles.emit("dot", 0, 0, 1) == 1
+    assert hazards.far_stride == governor.far_animation_stride
+
+
+def test_rect_reject_never_changes_collision_results(mm):
+    player = mm.Player(0, 0, 50, 50)
+    player.update_sprite()
+    near = mm.Block(player.rect.right + 7, 0, 32)
+    hollow = mm.Block(player.rect.right - 4, 0, 32)
+    hollow.mask.clear()  # rects overlap, masks do not
+
+    for blocks in ([near], [hollow], [hollow, near]):
+        assert (mm.collide(player, blocks, mm.PLAYER_VEL * 2, rect_reject=True)
+                is mm.collide(player, blocks, mm.PLAYER_VEL * 2))
+    assert mm.collide(player, [near], mm.PLAYER_VEL * 2, rect_reject=True) is near
+    assert mm.collide(player, [hollow], mm.PLAYER_VEL * 2, rect_reject=True) is None
+
+
+def test_env_step_returns_observation_and_reward(mm):
+    env = mm.MangoEnv(max_steps=5)
+    obs = env.reset()
+    assert obs.shape == (mm.OBSERVATION_SIZE,)
+    assert obs.dtype == mm.np.float32
+
+    level = env.level
+    mango = level.mangoes[0]
+    mango.rect.center = level.player.rect.center
+
+    obs, reward, done, info = env.step(0)
+
+    assert reward == 1.0
+    assert obs[6] == 1  # score
+    assert not info["won"]
+
+
+def test_env_reset_restores_starting_state(mm):
+    env = mm.MangoEnv(max_steps=3)
+    start = env.reset().copy()
+    done = False
+    while not done:
+        _, _, done, _ = env.step(2)
+
+    assert (env.reset() == start).all()
+
+
+def test_env_rollouts_after_reset_are_reproducible(mm):
+    env = mm.MangoEnv()
+    actions = mm.np.random.default_rng(0).integers(len(mm.ACTIONS), size=250)
+
+    def rollout():
+        trace = [env.reset().copy()]
+        for action in actions:
+            obs, _, _, _ = env.step(action)
+            trace.append(mm.np.append(obs, [f.animation_name == "on" for f in env.level.fires]))
+        return trace
+
+    first = rollout()
+    second = rollout()
+
+    assert all((a == b).all() for a, b in zip(first, second))
+
+
+def test_vector_env_writes_observations_into_shared_memory(mm):
+    with mm.VectorMangoEnv(2, max_steps=10, frame_size=(20, 16)) as venv:
+        states = venv.reset()
+        assert states.shape == (2, mm.OBSERVATION_SIZE)
+        before = states[:, 0].copy()
+
+        venv.step([2, 1])  # velocity is applied on the following frame
+        states, rewards, dones = venv.step([2, 1])
+
+        assert states[0, 0] > before[0] and states[1, 0] < before[1]
+        assert rewards.shape == dones.shape == (2,)
+        assert venv.frames.shape == (2, 16, 20, 3)
+        assert venv.frames.any()
+
+
+def small_layout(mangoes, fires=()):
+    return {
+        "block_size": 96,
+        "player": (100, 800 - 96 * 2),
+        "blocks": [(i * 96, 800 - 96) for i in range(-2, 12)],
+        "mangoes": list(mangoes),
+        "fires": list(fires),
+    }
+
+
+def test_validator_finds_reachable_and_unreachable_mangoes(mm):
+    layout = small_layout([(600, 800 - 96 - 60, 50, 50), (600, -2000, 50, 50)])
+
+    report = mm.validate_layout(layout, max_seconds=5)
+
+    assert list(report.reachable) == [0]
+    assert report.unreachable == [1]
+    assert report.requires_fire == []
+    assert report.unproven == []  # too high to ever reach, no search needed
+
+
+@pytest.fixture
+def game():
+    """
+    Import MangoMasters with its real sprites, for tests whose result
+    depends on the exact frame masks.
+    """
+    THIS_DIR = os.path.dirname(__file__)
+    if THIS_DIR not in sys.path:
+        sys.path.insert(0, THIS_DIR)
+    mod = importlib.reload(importlib.import_module("MangoMasters"))
+    mod.pygame.display.init()
+    mod.pygame.display.set_mode((1, 1))
+    return mod
+
+
+def replays(game, layout, index, inputs):
+    """Play per-frame inputs through the game loop and report whether the mango was collected."""
+    level = game.build_level(layout)
+    player = level.player
+    player.update_sprite()
+    for action in inputs:  # the frame order of MangoEnv.step
+        left, right, jump = game.ACTIONS[action]
+        game.ANIMATION_CLOCK.advance()
+        if jump and player.jump_count < 2:
+            player.jump()
+        player.loop(game.FPS)
+        level.hazards.update(player, level.offset_x)
+        game.handle_move(player, level.objects, level.terrain,
+                         keys={game.pygame.K_LEFT: left, game.pygame.K_RIGHT: right})
+    return level.mangoes[index].collected
+
+
+def chunk_layout(game, seed, index):
+    chunk = game.generate_chunk(seed, index)
+    return {
+        "block_size": 96,
+        "player": (chunk.blocks[0][0], game.HEIGHT - 96 * 2),
+        "blocks": list(chunk.blocks),
+        "mangoes": list(chunk.mangoes),
+        "fires": list(chunk.fires),
+    }
+
+
+def test_validator_paths_replay_in_the_game_loop(game):
+    layout = small_layout([(500, 800 - 96 * 3, 50, 50), (900, 800 - 96 - 60, 50, 50)])
+    layout["blocks"].append((450, 800 - 96 * 2))
+    report = game.validate_layout(layout, max_seconds=5)
+    assert sorted(report.reachable) == [0, 1]
+
+    for index, inputs in report.reachable.items():
+        assert replays(game, layout, index, inputs)
+
+
+def test_validator_paths_replay_on_default_and_generated_levels(game):
+    layouts = [game.default_layout(), chunk_layout(game, 1, 2), chunk_layout(game, 1, 7)]
+
+    for layout in layouts:
+        report = game.validate_layout(layout)
+        assert sorted(report.reachable) == list(range(len(layout["mangoes"])))
+        for index, inputs in report.reachable.items():
+            assert replays(game, layout, index, inputs)
+
+
+def test_exact_search_finds_mangoes_the_coarse_search_merges_away(game):
+    layout = chunk_layout(game, 5, 37)
+    paths, _ = game.search_layout(layout, frames_per_input=3)
+    assert 1 not in paths
+
+    inputs, _, _ = game.search_mango(layout, 1, frames_per_input=3)
+
+    assert inputs is not None
+    assert replays(game, layout, 1, inputs)
+
+
+def test_validator_flags_mango_that_needs_standing_on_fire(mm):
+    # The mango is too high to reach from the floor, but a tall fire trap
+    # works as a step up; standing on it counts as touching it.
+    layout = small_layout([(620, 360, 50, 50)], fires=[(600, 800 - 96 * 2, 96, 96)])
+
+    report = mm.validate_layout(layout, max_seconds=5, max_states=20_000)
+
+    assert report.reachable == {}
+    assert report.requires_fire == [0]
+    assert report.unproven == [0]
+
+
+def test_generate_chunk_is_deterministic_per_seed(mm):
+    assert mm.generate_chunk(7, 3) == mm.generate_chunk(7, 3)
+    assert mm.generate_chunk(7, 3) != mm.generate_chunk(8, 3)
+    assert all(not chunk.fires for chunk in (mm.generate_chunk(7, 0), mm.generate_chunk(7, -1)))
+
+
+def test_endless_world_streams_and_retires_chunks(mm):
+    import time
+
+    level = mm.Level(mm.Player(100, 600, 50, 50), [], [], [])
+    world = mm.EndlessWorld(level, seed=1, per_frame=10)
+    try:
+        wanted = set(world.window(0))
+        deadline = time.time() + 5
+        while set(world.loaded) != wanted and time.time() < deadline:
+            world.update(0)
+            time.sleep(0.01)
+        assert set(world.loaded) == wanted
+        assert level.terrain.query(mm.pygame.Rect(0, 700, 96, 96))
+
+        far = world.chunk_width * 50
+        deadline = time.time() + 5
+        while set(world.loaded) != set(world.window(far)) and time.time() < deadline:
+            world.update(far)
+            time.sleep(0.01)
+        assert not wanted & set(world.loaded)
+        assert level.terrain.query(mm.pygame.Rect(0, 700, 96, 96)) == []
+        assert len(level.fires) == sum(len(v[2]) for v in world.loaded.values())
+        assert min(level.terrain.chunks)[0] * level.terrain.chunk_size >= far - world.chunk_width * 2
+    finally:
+        world.close()
+
+
+def test_endless_respawn_point_is_in_view(mm):
+    import time
+
+    level = mm.Level(mm.Player(100, 600, 50, 50), [], [], [])
+    world = mm.EndlessWorld(level, seed=1, per_frame=10)
+    try:
+        offset_x = 2500
+        x, y = world.respawn_point(offset_x)  # nothing loaded yet: move the camera
+        assert level.offset_x <= x <= level.offset_x + mm.WIDTH - 64
+
+        level.offset_x = offset_x
+        deadline = time.time() + 5
+        while set(world.loaded) != set(world.window(offset_x)) and time.time() < deadline:
+            world.update(offset_x)
+            time.sleep(0.01)
+        x, y = world.respawn_point(offset_x)
+        assert level.offset_x == offset_x
+        assert offset_x <= x <= offset_x + mm.WIDTH - 64
+        below = mm.pygame.Rect(x, y + 64, 64, mm.HEIGHT - y - 64)
+        assert level.terrain.query(below)
+    finally:
+        world.close()
+
+
+def test_display_scales_internal_surface_to_window(mm):
+    display = mm.Display(scale=2)
+
+    assert display.surface.get_size() == (mm.WIDTH, mm.HEIGHT)
+    assert display.window.get_size() == (mm.WIDTH * 2, mm.HEIGHT * 2)
+    display.surface.fill((0, 0, 0))
+    display.surface.set_at((3, 4), (255, 0, 0))
+    display.present()
+
+    assert display.window.get_at((7, 9))[:3] == (255, 0, 0)
+    assert display.window.get_at((5, 9))[:3] == (0, 0, 0)
+
+
+def test_display_falls_back_without_renderer_and_rejects_bad_scale(mm):
+    # The dummy driver has no renderer, so SCALED/vsync use software scaling.
+    display = mm.Display(scale=1, vsync=True)
+    assert not display.scaled
+    assert display.surface is display.window
+
+    with pytest.raises(ValueError):
+        mm.Display(scale=1.5)
+
+
+def test_display_asks_for_gpu_scaling_above_scale_1(mm, monkeypatch):
+    set_mode = mm.pygame.display.set_mode
+    requested = []
+
+    def record(size, flags=0, **kwargs):
+        requested.append(flags & mm.pygame.SCALED)
+        return set_mode(size, flags, **kwargs)
+
+    monkeypatch.setattr(mm.pygame.display, "set_mode", record)
+    mm.Display(scale=1)
+    assert requested == [0]
+    mm.Display(scale=3)
+    assert requested[1] == mm.pygame.SCALED
+
+
+def dirty_renderer_scene(mm, monkeypatch):
+    presented = []
+    monkeypatch.setattr(mm.display, "present", lambda rects=None: presented.append(rects))
+    level = mm.build_level()
+    level.player.update_sprite()
+    background, bg_image = [(0, 0)], mm.pygame.Surface((mm.WIDTH, mm.HEIGHT))
+    bg_image.fill((10, 20, 30))
+    window = mm.pygame.Surface((mm.WIDTH, mm.HEIGHT))
+    renderer = mm.DirtyRenderer()
+
+    def frame(offset_x=0):
+        return renderer.draw(window, background, bg_image, level.player, level.objects,
+                             offset_x, level.terrain)
+
+    def matches(offset_x=0):
+        expected = mm.pygame.Surface(window.get_size())
+        mm.render_scene(expected, background, bg_image, level.player, level.objects,
+                        offset_x, level.terrain)
+        return mm.pygame.image.tobytes(window, "RGB") == mm.pygame.image.tobytes(expected, "RGB")
+
+    return level, frame, matches, presented
+
+
+def test_dirty_renderer_updates_only_changed_rects(mm, monkeypatch):
+    level, frame, matches, presented = dirty_renderer_scene(mm, monkeypatch)
+
+    assert frame() is None  # first frame is always full
+    assert frame() is None  # builds the background/terrain cache
+    assert frame() == []    # nothing changed
+
+    level.player.rect.x += 3
+    dirty = frame()
+    assert len(dirty) == 1 and dirty[0].contains(level.player.sprite.get_rect(
+        topleft=level.player.rect.topleft))
+    assert matches()
+
+    assert frame(offset_x=10) is None  # scrolling falls back to full redraws
+    assert presented[-1] is None
+
+
+def test_dirty_renderer_redraws_everything_when_the_camera_settles(mm, monkeypatch):
+    level, frame, matches, presented = dirty_renderer_scene(mm, monkeypatch)
+    frame()
+    frame()
+
+    assert frame(offset_x=10) is None
+    level.player.rect.y -= 40  # the cache is rebuilt on this still frame
+    assert frame(offset_x=10) is None
+    assert presented[-1] is None
+    assert matches(offset_x=10)
+
+
+def test_dirty_renderer_redraws_everything_when_terrain_changes(mm, monkeypatch):
+    level, frame, matches, presented = dirty_renderer_scene(mm, monkeypatch)
+    frame()
+    frame()
+    assert frame() == []
+
+    block = level.terrain.query(mm.pygame.Rect(0, 0, mm.WIDTH, mm.HEIGHT))[-1]
+    block.destroy()
+    assert frame() is None
+    assert presented[-1] is None
+    assert matches()
+
+
+def test_memory_report_groups_entities_and_finds_duplicates(mm):
+    level = mm.build_level()
+    level.player.update_sprite()
+
+    report = mm.memory_report(level)
+
+    assert report["entities"]["Mango"] == len(level.mangoes)
+    assert report["entities"]["Block"] == len(level.terrain)
+    block = report["groups"]["Block"]
+    assert block["surfaces"] == len(level.terrain)
+    assert block["surface_bytes"] == len(level.terrain) * 96 * 96 * 4
+    # Every block owns an identical copy of the block sprite.
+    assert report["duplicates"]["by_group"]["Block"]["surfaces"] == len(level.terrain) - 1
+    # Mangoes share one cached image, so it is counted once.
+    assert report["groups"]["Mango"]["surfaces"] == 0
+    assert report["total_bytes"] == sum(g["surface_bytes"] + g["mask_bytes"]
+                                        for g in report["groups"].values())
+
+
+def test_memory_monitor_appends_json_lines(mm, tmp_path):
+    import json
+
+    path = tmp_path / "memory.jsonl"
+    monitor = mm.MemoryMonitor(dump_path=str(path), dump_every=2)
+    level = mm.build_level()
+    for _ in range(4):
+        monitor.update(level)
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record["frame"] for record in records] == [2, 4]
+    assert records[0]["entities"]["Fire"] == len(level.fires)
+
+
+def test_animation_tables_are_shared_and_follow_the_global_clock(mm):
+    first, second = mm.Player(0, 0, 10, 10), mm.Player(50, 0, 10, 10)
+    assert first.animations is second.animations
+    table = first.animations
+    run_right = table.images[mm.Player.RUN * 2 + 1]
+    assert len(run_right) == table.periods[mm.Player.RUN * 2 + 1]
+
+    first.move_right(5)
+    for tick in range(4):
+        first.update_sprite()
+        assert first.sprite is run_right[tick % len(run_right)]
+        assert first.mask is table.masks[mm.Player.RUN * 2 + 1][tick % len(run_right)]
+        first.update()
+        assert first.mask is table.masks[mm.Player.RUN * 2 + 1][tick % len(run_right)]
+        mm.ANIMATION_CLOCK.advance()
+    assert first.animation_count == 4
+
+    fires = [mm.Fire(i * 40, 0, 16, 32) for i in range(3)]
+    assert len({id(fire.animations) for fire in fires}) == 1
+
+
+def nav_terrain(mm, platforms):
+    terrain = mm.TerrainGrid()
+    for x in range(0, 960, 96):
+        terrain.add(mm.Block(x, 800 - 96, 96))
+    blocks = [mm.Block(x, y, 96) for x, y in platforms]
+    for block in blocks:
+        terrain.add(block)
+    return terrain, blocks
+
+
+def test_nav_graph_uses_jump_physics_for_edges(mm):
+    floor_y = 800 - 96
+    terrain, _ = nav_terrain(mm, [(300, floor_y - 96 * 2), (600, floor_y - 96 * 3),
+                                  (800, floor_y - 96 * 6)])
+    nav = mm.NavGraph(terrain)
+    ids = {surface.y: sid for sid, surface in nav.surfaces.items()}
+    floor, low, high, sky = (ids[floor_y], ids[floor_y - 96 * 2], ids[floor_y - 96 * 3],
+                             ids[floor_y - 96 * 6])
+
+    assert nav.edges[floor][low].kind == "double_jump"
+    assert nav.edges[low][high].kind == "jump"
+    assert nav.edges[low][floor].kind == "walk"
+    assert sky not in nav.edges[floor] and sky not in nav.edges[high]
+
+    player = mm.Player(100, floor_y - mm.PLAYER_SPRITE_SIZE, 50, 50)
+    player.update_sprite()
+    mango = mm.Mango(620, floor_y - 96 * 3 - 60, 50, 50)
+    path = nav.path_to_mango(player, mango)
+    assert [(edge.source, edge.target) for edge in path] == [(floor, low), (low, high)]
+    assert nav.find_path(floor, [sky]) is None
+
+
+def test_nav_graph_paths_start_from_the_player_position(mm):
+    floor_y = 800 - 96
+    terrain, _ = nav_terrain(mm, [(150, floor_y - 96 * 2), (750, floor_y - 96 * 2),
+                                  (450, floor_y - 96 * 4)])
+    nav = mm.NavGraph(terrain)
+    ids = {(surface.left, surface.y): sid for sid, surface in nav.surfaces.items()}
+
+    # Both low platforms lead up to the mango; the one next to the player
+    # saves walking across the floor.
+    player = mm.Player(800, floor_y - mm.PLAYER_SPRITE_SIZE, 50, 50)
+    player.update_sprite()
+    mango = mm.Mango(470, floor_y - 96 * 4 - 60, 50, 50)
+    path = nav.path_to_mango(player, mango)
+    assert [edge.target for edge in path] == [ids[750, floor_y - 96 * 2],
+                                              ids[450, floor_y - 96 * 4]]
+
+
+def test_nav_graph_updates_incrementally_when_blocks_change(mm):
+    floor_y = 800 - 96
+    terrain, (step, ledge) = nav_terrain(mm, [(300, floor_y - 96), (450, floor_y - 96 * 2)])
+    nav = mm.NavGraph(terrain)
+
+    def graph(nav):
+        surfaces = set(nav.surfaces.values())
+        edges = {(nav.surfaces[e.source], nav.surfaces[e.target], e.kind)
+                 for targets in nav.edges.values() for e in targets.values()}
+        return surfaces, edges
+
+    step.destroy()
+    assert graph(nav) == graph(mm.NavGraph(terrain))
+    ledge.move(450, floor_y - 96 * 4)
+    assert graph(nav) == graph(mm.NavGraph(terrain))
+    ledge.resize(48)
+    assert graph(nav) == graph(mm.NavGraph(terrain))
+    assert not any(surface.left == 300 and surface.y == floor_y - 96
+                   for surface in nav.surfaces.values())
+
+
+def test_nav_graph_update_cost_does_not_grow_with_the_level(mm, monkeypatch):
+    floor_y = 800 - 96
+
+    def checks_for_destroy(screens):
+        terrain = mm.TerrainGrid()
+        islands = [mm.Block(x + dx, floor_y, 96) for x in range(0, 960 * screens, 480)
+                   for dx in (0, 96)]
+        for block in islands:
+            terrain.add(block)
+        nav = mm.NavGraph(terrain)
+        calls = []
+        connect = nav._connect
+        monkeypatch.setattr(nav, "_connect", lambda *pair: calls.append(pair) or connect(*pair))
+        islands[1].destroy()
+        return len(calls)
+
+    assert checks_for_destroy(3) == checks_for_destroy(12)